@@ -9,6 +9,9 @@ import importlib.util
 
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
+# The GLM agents need the openai SDK, which the unit-test CI job doesn't install
+HAS_OPENAI = importlib.util.find_spec("openai") is not None
+
 
 # =============================================================================
 # Import Tests
@@ -346,6 +349,24 @@ def test_v3_get_tools_for_agent():
     return True
 
 
+def test_v3_glm_get_tools_for_agent():
+    """Test v3 GLM get_tools_for_agent reads OpenAI-style tool schemas."""
+    if not HAS_OPENAI:
+        print("SKIP: test_v3_glm_get_tools_for_agent (openai not installed)")
+        return True
+
+    from v3_subagent_glm import get_tools_for_agent, BASE_TOOLS
+
+    explore_names = {t["function"]["name"] for t in get_tools_for_agent("explore")}
+    assert explore_names == {"bash", "read_file"}
+
+    assert get_tools_for_agent("code") is BASE_TOOLS
+    assert get_tools_for_agent("unknown") is BASE_TOOLS
+
+    print("PASS: test_v3_glm_get_tools_for_agent")
+    return True
+
+
 def test_v3_get_agent_descriptions():
     """Test v3 get_agent_descriptions output."""
     from v3_subagent import get_agent_descriptions
@@ -527,6 +548,161 @@ def test_v4_skill_tool_schema():
     return True
 
 
+def test_v4_glm_skill_cache_outside_workspace():
+    """Test v4 GLM keeps its SKILL.md parse cache as JSON in the user cache dir."""
+    if not HAS_OPENAI:
+        print("SKIP: test_v4_glm_skill_cache_outside_workspace (openai not installed)")
+        return True
+
+    import json
+    import tempfile
+    from pathlib import Path
+    import v4_skills_agent_glm as agent
+
+    orig = os.environ.get("XDG_CACHE_HOME")
+    with tempfile.TemporaryDirectory() as skills, tempfile.TemporaryDirectory() as cache:
+        os.environ["XDG_CACHE_HOME"] = cache
+        try:
+            skill_dir = Path(skills) / "demo"
+            skill_dir.mkdir()
+            (skill_dir / "SKILL.md").write_text("---\nname: demo\ndescription: Demo\n---\nBody\n")
+
+            loader = agent.SkillLoader(Path(skills))
+            assert os.listdir(skills) == ["demo"]
+            assert loader._cache_path().parent == Path(cache) / "mini-claude-code"
+            with open(loader._cache_path(), encoding="utf-8") as f:
+                assert f"{skill_dir / 'SKILL.md'}" in json.load(f)
+
+            # A second load is served from the cache and rebuilds the same skills
+            assert agent.SkillLoader(Path(skills)).skills == loader.skills
+        finally:
+            if orig is None:
+                os.environ.pop("XDG_CACHE_HOME", None)
+            else:
+                os.environ["XDG_CACHE_HOME"] = orig
+
+    print("PASS: test_v4_glm_skill_cache_outside_workspace")
+    return True
+
+
+def test_v4_glm_skill_content_follows_edits():
+    """Test v4 GLM re-reads a skill body after its SKILL.md changes mid-session."""
+    if not HAS_OPENAI:
+        print("SKIP: test_v4_glm_skill_content_follows_edits (openai not installed)")
+        return True
+
+    import tempfile
+    from pathlib import Path
+    import v4_skills_agent_glm as agent
+
+    orig = os.environ.get("XDG_CACHE_HOME")
+    with tempfile.TemporaryDirectory() as skills, tempfile.TemporaryDirectory() as cache:
+        os.environ["XDG_CACHE_HOME"] = cache
+        try:
+            skill_md = Path(skills) / "demo" / "SKILL.md"
+            skill_md.parent.mkdir()
+            skill_md.write_text("---\nname: demo\ndescription: Demo\n---\nOld body\n")
+
+            loader = agent.SkillLoader(Path(skills))
+            assert "Old body" in loader.get_skill_content("demo")
+            assert loader.get_skill_content("demo") is loader.get_skill_content("demo")
+
+            skill_md.write_text("---\nname: demo\ndescription: Demo\n---\nNew, longer body\n")
+            content = loader.get_skill_content("demo")
+            assert "New, longer body" in content and "Old body" not in content
+        finally:
+            if orig is None:
+                os.environ.pop("XDG_CACHE_HOME", None)
+            else:
+                os.environ["XDG_CACHE_HOME"] = orig
+
+    print("PASS: test_v4_glm_skill_content_follows_edits")
+    return True
+
+
+def test_v4_glm_request_prefix_is_stable():
+    """Test v4 GLM sends a byte-identical system + tools prefix on every request."""
+    if not HAS_OPENAI:
+        print("SKIP: test_v4_glm_request_prefix_is_stable (openai not installed)")
+        return True
+
+    import json
+    from types import SimpleNamespace as NS
+    import v4_skills_agent_glm as agent
+
+    def call(index, name, args):
+        function = NS(name=name, arguments=json.dumps(args))
+        return NS(index=index, id=f"c{index}", function=function)
+
+    def chunk(content=None, tool_calls=None):
+        return NS(choices=[NS(delta=NS(content=content, tool_calls=tool_calls))])
+
+    skill = next(iter(agent.SKILLS.list_skills()), "missing")
+    todo = [{"content": "x", "status": "in_progress", "activeForm": "doing x"}]
+    turns = [
+        [chunk(tool_calls=[call(0, "Skill", {"skill": skill}), call(1, "TodoWrite", {"items": todo})])],
+        [chunk("done")],
+    ]
+    requests = []
+
+    def create(**kw):
+        requests.append(json.dumps([kw["messages"][0], kw["tools"]], ensure_ascii=False, sort_keys=True))
+        return iter(turns.pop(0))
+
+    before = json.dumps([agent._SYSTEM_MSG, agent.ALL_TOOLS], ensure_ascii=False, sort_keys=True)
+    orig = agent.client
+    agent.client = NS(chat=NS(completions=NS(create=create)))
+    try:
+        agent.agent_loop([agent._SYSTEM_MSG, {"role": "user", "content": "go"}])
+    finally:
+        agent.client = orig
+
+    assert requests == [before, before]
+
+    print("PASS: test_v4_glm_request_prefix_is_stable")
+    return True
+
+
+def test_v4_glm_task_cache():
+    """Test v4 GLM reuses read-only subagent results until something mutates the workspace."""
+    if not HAS_OPENAI:
+        print("SKIP: test_v4_glm_task_cache (openai not installed)")
+        return True
+
+    import tempfile
+    from types import SimpleNamespace as NS
+    import v4_skills_agent_glm as agent
+
+    answers = []
+
+    def create(**kw):
+        answers.append(f"answer {len(answers)}")
+        return iter([NS(choices=[NS(delta=NS(content=answers[-1], tool_calls=None))])])
+
+    orig = agent.client
+    agent.client = NS(chat=NS(completions=NS(create=create)))
+    agent._TASK_CACHE.clear()
+    try:
+        assert agent.run_task("look", "find the config", "explore") == "answer 0"
+        assert agent.run_task("look", "find the config", "explore") == "answer 0"
+        assert len(answers) == 1
+
+        with tempfile.TemporaryDirectory(dir=agent.WORKDIR) as d:
+            rel = os.path.join(os.path.relpath(d, agent.WORKDIR), "f.txt")
+            agent.execute_tool("write_file", {"path": rel, "content": "x"})
+        assert agent.run_task("look", "find the config", "explore") == "answer 1"
+
+        # A bash call that might change files also invalidates it
+        agent.execute_tool("bash", {"command": "true && true"})
+        assert agent.run_task("look", "find the config", "explore") == "answer 2"
+    finally:
+        agent.client = orig
+        agent._TASK_CACHE.clear()
+
+    print("PASS: test_v4_glm_task_cache")
+    return True
+
+
 # =============================================================================
 # Path Safety Tests
 # =============================================================================
@@ -578,6 +754,512 @@ def test_base_url_config():
             os.environ.pop("ANTHROPIC_BASE_URL", None)
 
 
+# =============================================================================
+# Bash Tool Tests
+# =============================================================================
+
+def test_v1_bash_persistent_shell():
+    """Test v1 run_bash keeps shell state between calls."""
+    if sys.platform == "win32":
+        print("SKIP: test_v1_bash_persistent_shell (no bash on Windows)")
+        return True
+
+    import v1_basic_agent
+
+    v1_basic_agent.run_bash("export LCC_TEST_VAR=persisted")
+    assert v1_basic_agent.run_bash("echo $LCC_TEST_VAR") == "persisted"
+
+    # Output without trailing newline and empty output
+    assert v1_basic_agent.run_bash("printf abc") == "abc"
+    assert v1_basic_agent.run_bash("true") == "(no output)"
+
+    # Shell restarts after exit
+    v1_basic_agent.run_bash("exit 3")
+    assert v1_basic_agent.run_bash("echo back") == "back"
+
+    print("PASS: test_v1_bash_persistent_shell")
+    return True
+
+
+def test_bash_output_cannot_fake_end_marker():
+    """Test output that looks like an end marker doesn't end the read early."""
+    if sys.platform == "win32":
+        print("SKIP: test_bash_output_cannot_fake_end_marker (no bash on Windows)")
+        return True
+
+    import v0_bash_agent
+    import v1_basic_agent
+    modules = [v0_bash_agent, v1_basic_agent]
+    if HAS_OPENAI:
+        import v0_bash_agent_glm
+        import v1_basic_agent_glm
+        import v2_todo_agent_glm
+        import v4_skills_agent_glm
+        modules += [v0_bash_agent_glm, v1_basic_agent_glm, v2_todo_agent_glm, v4_skills_agent_glm]
+
+    for mod in modules:
+        out = mod.run_bash("echo __END__0__; echo __END_deadbeef_0__; echo after")
+        assert out.strip() == "__END__0__\n__END_deadbeef_0__\nafter", (mod.__name__, out)
+        # The shell stays in sync for the next command
+        assert mod.run_bash("echo next").strip() == "next", mod.__name__
+
+    print("PASS: test_bash_output_cannot_fake_end_marker")
+    return True
+
+
+def test_v1_edit_file():
+    """Test v1 run_edit replaces only the first match and reads stay fresh."""
+    import tempfile
+    import v1_basic_agent
+
+    with tempfile.TemporaryDirectory(dir=v1_basic_agent.WORKDIR) as d:
+        rel = os.path.join(os.path.relpath(d, v1_basic_agent.WORKDIR), "f.txt")
+        v1_basic_agent.run_write(rel, "a-b-a\n")
+        assert v1_basic_agent.run_read(rel) == "a-b-a"
+
+        assert v1_basic_agent.run_edit(rel, "a", "X") == f"Edited {rel}"
+        assert v1_basic_agent.run_read(rel) == "X-b-a"
+        assert "not found" in v1_basic_agent.run_edit(rel, "zzz", "y")
+
+        # Changes made outside the tools are picked up
+        with open(os.path.join(d, "f.txt"), "w") as f:
+            f.write("changed outside\n")
+        assert v1_basic_agent.run_read(rel) == "changed outside"
+
+    print("PASS: test_v1_edit_file")
+    return True
+
+
+def test_v1_file_cache_is_bounded():
+    """Test v1 keeps at most _FILE_CACHE_MAX files in its read cache."""
+    import tempfile
+    import v1_basic_agent
+
+    cap = v1_basic_agent._FILE_CACHE_MAX
+    with tempfile.TemporaryDirectory(dir=v1_basic_agent.WORKDIR) as d:
+        rel = os.path.relpath(d, v1_basic_agent.WORKDIR)
+        for i in range(cap + 10):
+            name = os.path.join(rel, f"{i}.txt")
+            v1_basic_agent.run_write(name, f"file {i}\n")
+            assert v1_basic_agent.run_read(name) == f"file {i}"
+        assert len(v1_basic_agent._file_cache) <= cap
+
+        # Least recently used entries are evicted first
+        first = v1_basic_agent.safe_path(os.path.join(rel, "0.txt"))
+        last = v1_basic_agent.safe_path(os.path.join(rel, f"{cap + 9}.txt"))
+        assert first not in v1_basic_agent._file_cache
+        assert last in v1_basic_agent._file_cache
+
+    print("PASS: test_v1_file_cache_is_bounded")
+    return True
+
+
+def test_write_rechecks_symlinks():
+    """Test writes resolve the path again instead of using the read cache."""
+    if sys.platform == "win32":
+        print("SKIP: test_write_rechecks_symlinks (symlinks need privileges)")
+        return True
+
+    import tempfile
+    import v1_basic_agent
+    modules = [v1_basic_agent]
+    if HAS_OPENAI:
+        import v2_todo_agent_glm
+        modules.append(v2_todo_agent_glm)
+
+    for mod in modules:
+        with tempfile.TemporaryDirectory(dir=mod.WORKDIR) as d, \
+                tempfile.TemporaryDirectory() as outside:
+            rel = os.path.join(os.path.relpath(d, mod.WORKDIR), "link")
+            mod.safe_path(rel)  # cached while the path is still inside
+            os.symlink(os.path.join(outside, "target"), os.path.join(d, "link"))
+
+            for result in (mod.run_write(rel, "x"), mod.run_edit(rel, "x", "y")):
+                assert "escapes workspace" in result or "逃逸工作区" in result, result
+            assert not os.path.exists(os.path.join(outside, "target"))
+
+    print("PASS: test_write_rechecks_symlinks")
+    return True
+
+
+def test_v1_compact_history():
+    """Test v1 compact_history folds old turns without splitting tool pairs."""
+    import v1_basic_agent
+
+    messages = [{"role": "user", "content": "start"}]
+    for i in range(30):
+        messages.append({"role": "assistant", "content": [
+            {"type": "tool_use", "id": f"t{i}", "name": "bash", "input": {"command": f"echo {i}"}},
+        ]})
+        messages.append({"role": "user", "content": [
+            {"type": "tool_result", "tool_use_id": f"t{i}", "content": str(i)},
+        ]})
+    original = messages
+    v1_basic_agent.compact_history(messages)
+
+    assert messages is original
+    assert len(messages) <= v1_basic_agent.KEEP_RECENT + 1
+    assert messages[0]["role"] == "user"
+    assert "echo 0" in messages[0]["content"]
+    assert messages[1]["role"] == "assistant"
+    roles = [m["role"] for m in messages]
+    assert all(a != b for a, b in zip(roles, roles[1:]))
+
+    # Short histories are left alone
+    short = messages[:3]
+    v1_basic_agent.compact_history(short)
+    assert len(short) == 3
+
+    print("PASS: test_v1_compact_history")
+    return True
+
+
+def test_v2_glm_read_cache():
+    """Test v2 GLM caches only small files it reads, and edits bypass the cache."""
+    if not HAS_OPENAI:
+        print("SKIP: test_v2_glm_read_cache (openai not installed)")
+        return True
+
+    import tempfile
+    import v2_todo_agent_glm as agent
+
+    with tempfile.TemporaryDirectory(dir=agent.WORKDIR) as d:
+        rel = os.path.relpath(d, agent.WORKDIR)
+        small, big = os.path.join(rel, "small.txt"), os.path.join(rel, "big.txt")
+        agent.run_write(small, "a\nb\n")
+        agent.run_write(big, "x" * (agent._LARGE_FILE + 1))
+
+        # Edits (found or not) don't fill the cache
+        assert "未找到" in agent.run_edit(small, "zzz", "y")
+        assert agent.run_edit(small, "a", "A") == f"已编辑 {small}"
+        assert str(agent.safe_path(small)) not in agent._READ_CACHE
+
+        assert agent.run_read(small) == "A\nb"
+        assert str(agent.safe_path(small)) in agent._READ_CACHE
+        assert len(agent.run_read(big)) == 50000
+        assert str(agent.safe_path(big)) not in agent._READ_CACHE
+
+        # A hit moves the file to the most recently used end
+        other = os.path.join(rel, "other.txt")
+        agent.run_write(other, "o")
+        agent.run_read(other)
+        agent.run_read(small)
+        assert next(reversed(agent._READ_CACHE)) == str(agent.safe_path(small))
+
+    print("PASS: test_v2_glm_read_cache")
+    return True
+
+
+def test_v2_glm_large_read_matches_small_read():
+    """Test v2 GLM's mmap path for large files returns the same text as the small-file path."""
+    if not HAS_OPENAI:
+        print("SKIP: test_v2_glm_large_read_matches_small_read (openai not installed)")
+        return True
+
+    import tempfile
+    import v2_todo_agent_glm as agent
+
+    with tempfile.TemporaryDirectory(dir=agent.WORKDIR) as d:
+        fp = agent.Path(d) / "crlf.txt"
+        # CRLF line endings and multibyte characters at odd byte offsets
+        fp.write_bytes("".join(f"第{i}行 héllo\r\n" for i in range(8000)).encode("utf-8"))
+        assert fp.stat().st_size > agent._LARGE_FILE
+
+        small = agent._read_lines(fp, fp.stat())
+        agent._read_cache_drop(fp)
+        for limit in (None, 3, 5000):
+            lines = small
+            if limit and limit < len(lines):
+                lines = lines[:limit] + [f"... ({len(lines) - limit} 更多行)"]
+            expected = "\n".join(lines)[:50000]
+            assert agent._read_large(fp, limit) == expected, limit
+            assert "\r" not in agent._read_large(fp, limit)
+
+    print("PASS: test_v2_glm_large_read_matches_small_read")
+    return True
+
+
+def test_v2_glm_elide_old_tool_results():
+    """Test v2 GLM elides large tool results from old turns only, and keeps them readable."""
+    if not HAS_OPENAI:
+        print("SKIP: test_v2_glm_elide_old_tool_results (openai not installed)")
+        return True
+
+    import re
+    import v2_todo_agent_glm as agent
+
+    big = "x" * (agent.ELIDE_MIN_BYTES + 1)
+    messages = []
+    for turn in range(agent.KEEP_TURNS + 1):
+        messages += [
+            {"role": "user", "content": f"turn {turn}"},
+            {"role": "tool", "tool_call_id": str(turn), "content": big + str(turn)},
+        ]
+
+    assert agent.elide_old_tool_results(messages) == 1
+    old = messages[1]["content"]
+    assert old.startswith("<tool_output id=") and old.endswith("</tool_output>")
+    assert all(m["content"] == big + str(t) for t, m in enumerate(messages[3::2], 1))
+
+    # The full text is still available through read_output
+    handle = re.match(r"<tool_output id=(\w+)", old).group(1)
+    assert agent.run_read_output(handle, 0, len(big) + 1) == big + "0"
+
+    # Already elided results are left alone on the next pass
+    assert agent.elide_old_tool_results(messages) == 0
+
+    print("PASS: test_v2_glm_elide_old_tool_results")
+    return True
+
+
+def test_v2_glm_output_store_is_bounded():
+    """Test v2 GLM evicts the oldest elided outputs past the size budget."""
+    if not HAS_OPENAI:
+        print("SKIP: test_v2_glm_output_store_is_bounded (openai not installed)")
+        return True
+
+    import v2_todo_agent_glm as agent
+
+    orig = agent.OUTPUT_STORE_MAX_CHARS
+    agent.OUTPUT_STORE_MAX_CHARS = 250
+    agent._OUTPUT_STORE.clear()
+    agent._output_store_chars = 0
+    try:
+        for handle in ("h-a", "h-b", "h-c"):
+            agent._store_output(handle, handle[-1] * 100)
+        assert "h-a" not in agent._OUTPUT_STORE
+        assert agent.run_read_output("h-c") == "c" * 100
+        assert "淘汰" in agent.run_read_output("h-a")
+    finally:
+        agent.OUTPUT_STORE_MAX_CHARS = orig
+
+    print("PASS: test_v2_glm_output_store_is_bounded")
+    return True
+
+
+# =============================================================================
+# Tool Scheduling Tests
+# =============================================================================
+
+def test_v1_tools_run_in_call_order():
+    """Test v1 agent_loop runs same-file edits and a later read in call order."""
+    import tempfile
+    from types import SimpleNamespace as NS
+    import v1_basic_agent
+
+    class FakeStream:
+        def __init__(self, response):
+            self.response = response
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *exc):
+            return False
+
+        def __iter__(self):
+            for block in self.response.content:
+                yield NS(type="content_block_stop", content_block=block)
+
+        def get_final_message(self):
+            return self.response
+
+    with tempfile.TemporaryDirectory(dir=v1_basic_agent.WORKDIR) as d:
+        rel = os.path.join(os.path.relpath(d, v1_basic_agent.WORKDIR), "f.txt")
+        v1_basic_agent.run_write(rel, "0\n")
+
+        edits = [
+            NS(type="tool_use", id=f"e{i}", name="edit_file",
+               input={"path": rel, "old_text": str(i), "new_text": str(i + 1)})
+            for i in range(20)
+        ]
+        read = NS(type="tool_use", id="r", name="read_file", input={"path": rel})
+        responses = [
+            NS(stop_reason="tool_use", content=edits + [read]),
+            NS(stop_reason="end_turn", content=[NS(type="text", text="done")]),
+        ]
+
+        orig = v1_basic_agent.client
+        v1_basic_agent.client = NS(messages=NS(stream=lambda **kw: FakeStream(responses.pop(0))))
+        try:
+            messages = v1_basic_agent.agent_loop([{"role": "user", "content": "go"}])
+        finally:
+            v1_basic_agent.client = orig
+
+        results = messages[2]["content"]
+        assert [r["content"] for r in results[:20]] == [f"Edited {rel}"] * 20
+        assert results[20]["content"] == "20"
+
+    print("PASS: test_v1_tools_run_in_call_order")
+    return True
+
+
+def test_v1_glm_tools_run_in_call_order():
+    """Test v1 GLM defers mutating tools and runs them in call order."""
+    if not HAS_OPENAI:
+        print("SKIP: test_v1_glm_tools_run_in_call_order (openai not installed)")
+        return True
+
+    import tempfile
+    import v1_basic_agent_glm as agent
+
+    with tempfile.TemporaryDirectory(dir=agent.WORKDIR) as d:
+        rel = os.path.join(os.path.relpath(d, agent.WORKDIR), "f.txt")
+        agent.run_write(rel, "a\n")
+
+        turn = agent._new_turn()
+        calls = [
+            agent._submit_parsed("read_file", {"path": rel}, turn),
+            agent._submit_parsed("edit_file", {"path": rel, "old_text": "a", "new_text": "b"}, turn),
+            agent._submit_parsed("edit_file", {"path": rel, "old_text": "b", "new_text": "c"}, turn),
+            agent._submit_parsed("bash", {"command": f"cat {rel}"}, turn),
+            agent._submit_parsed("read_file", {"path": rel}, turn),
+        ]
+        # Nothing after the first mutating call has run yet
+        assert all(not future.done() for _, future in calls[1:])
+
+        outputs = [future.result() for _, future in calls]
+        assert outputs[0] == "a"
+        assert outputs[1] == outputs[2] == f"Edited {rel}"
+        if sys.platform != "win32":
+            assert outputs[3] == "c"
+        assert outputs[4] == "c"
+
+    print("PASS: test_v1_glm_tools_run_in_call_order")
+    return True
+
+
+def test_v2_glm_tools_run_in_call_order():
+    """Test v2 GLM runs edits and reads after them in call order."""
+    if not HAS_OPENAI:
+        print("SKIP: test_v2_glm_tools_run_in_call_order (openai not installed)")
+        return True
+
+    import json
+    import tempfile
+    import v2_todo_agent_glm as agent
+
+    with tempfile.TemporaryDirectory(dir=agent.WORKDIR) as d:
+        rel = os.path.join(os.path.relpath(d, agent.WORKDIR), "f.txt")
+        agent.run_write(rel, "a\n")
+
+        turn = agent._new_turn()
+        calls = [
+            agent._start_tool("edit_file", json.dumps({"path": rel, "old_text": "a", "new_text": "b"}), turn),
+            agent._start_tool("edit_file", json.dumps({"path": rel, "old_text": "b", "new_text": "c"}), turn),
+            agent._start_tool("read_file", json.dumps({"path": rel}), turn),
+        ]
+        assert all(not future.done() for _, future in calls)
+
+        outputs = [future.result() for _, future in calls]
+        assert "错误" not in outputs[0] and "错误" not in outputs[1]
+        assert outputs[2] == "c"
+
+    print("PASS: test_v2_glm_tools_run_in_call_order")
+    return True
+
+
+def test_v3_glm_tools_run_in_call_order():
+    """Test v3 GLM starts reads concurrently but defers edits and later calls."""
+    if not HAS_OPENAI:
+        print("SKIP: test_v3_glm_tools_run_in_call_order (openai not installed)")
+        return True
+
+    import json
+    import tempfile
+    import v3_subagent_glm as agent
+
+    with tempfile.TemporaryDirectory(dir=agent.WORKDIR) as d:
+        rel = os.path.join(os.path.relpath(d, agent.WORKDIR), "f.txt")
+        agent.run_write(rel, "a\n")
+
+        turn = agent._new_turn()
+        calls = [
+            agent._start_tool("read_file", json.dumps({"path": rel}), turn),
+            agent._start_tool("edit_file", json.dumps({"path": rel, "old_text": "a", "new_text": "b"}), turn),
+            agent._start_tool("write_file", json.dumps({"path": rel, "content": "c\n"}), turn),
+            agent._start_tool("read_file", json.dumps({"path": rel}), turn),
+        ]
+        assert not isinstance(calls[0][1], agent._DeferredCall)
+        assert all(isinstance(future, agent._DeferredCall) for _, future in calls[1:])
+
+        outputs = [agent._tool_output(future) for _, future in calls]
+        assert outputs[0] == "a"
+        assert outputs[3] == "c"
+
+    print("PASS: test_v3_glm_tools_run_in_call_order")
+    return True
+
+
+def test_v4_glm_tools_run_in_call_order():
+    """Test v4 GLM runs bash and edits in call order in the persistent shell."""
+    if not HAS_OPENAI:
+        print("SKIP: test_v4_glm_tools_run_in_call_order (openai not installed)")
+        return True
+    if sys.platform == "win32":
+        print("SKIP: test_v4_glm_tools_run_in_call_order (no bash on Windows)")
+        return True
+
+    import json
+    import tempfile
+    import v4_skills_agent_glm as agent
+
+    with tempfile.TemporaryDirectory(dir=agent.WORKDIR) as d:
+        rel = os.path.relpath(d, agent.WORKDIR)
+        turn = agent._new_turn()
+        calls = [
+            agent._start_tool("write_file", json.dumps({"path": f"{rel}/f.txt", "content": "a"}), False, turn),
+            agent._start_tool("bash", json.dumps({"command": f"cd {rel}"}), False, turn),
+            agent._start_tool("bash", json.dumps({"command": "cat f.txt; cd - > /dev/null"}), False, turn),
+            agent._start_tool("edit_file", json.dumps({"path": f"{rel}/f.txt", "old_text": "a", "new_text": "b"}), False, turn),
+            agent._start_tool("read_file", json.dumps({"path": f"{rel}/f.txt"}), False, turn),
+        ]
+        assert all(isinstance(future, agent._DeferredCall) for _, future in calls)
+
+        outputs = [agent._tool_output(future) for _, future in calls]
+        assert outputs[2] == "a"
+        assert outputs[4] == "b"
+
+    print("PASS: test_v4_glm_tools_run_in_call_order")
+    return True
+
+
+def test_v4_glm_read_cache_drops_reads_racing_a_write():
+    """Test a read that overlaps a same-size write isn't cached as fresh."""
+    if not HAS_OPENAI:
+        print("SKIP: test_v4_glm_read_cache_drops_reads_racing_a_write (openai not installed)")
+        return True
+
+    import tempfile
+    import v4_skills_agent_glm as agent
+
+    with tempfile.TemporaryDirectory(dir=agent.WORKDIR) as d:
+        rel = os.path.join(os.path.relpath(d, agent.WORKDIR), "f.txt")
+        full = os.path.join(d, "f.txt")
+        agent.execute_tool("write_file", {"path": rel, "content": "old1"})
+        st = os.stat(full)
+
+        read = agent._DISPATCH["read_file"]
+
+        def racing_read(args):
+            # The read finishes with the old text, then a same-size write lands
+            # without moving the timestamp (coarse filesystem clock)
+            output = read(args)
+            agent.execute_tool("write_file", {"path": rel, "content": "new1"})
+            os.utime(full, ns=(st.st_atime_ns, st.st_mtime_ns))
+            return output
+
+        agent._DISPATCH["read_file"] = racing_read
+        try:
+            assert agent.execute_tool("read_file", {"path": rel}) == "old1"
+        finally:
+            agent._DISPATCH["read_file"] = read
+        assert agent.execute_tool("read_file", {"path": rel}) == "new1"
+
+    print("PASS: test_v4_glm_read_cache_drops_reads_racing_a_write")
+    return True
+
+
 # =============================================================================
 # Main
 # =============================================================================
@@ -602,6 +1284,7 @@ if __name__ == "__main__":
         # v3 tests
         test_v3_agent_types_structure,
         test_v3_get_tools_for_agent,
+        test_v3_glm_get_tools_for_agent,
         test_v3_get_agent_descriptions,
         test_v3_task_tool_schema,
         # v4 tests
@@ -611,10 +1294,32 @@ if __name__ == "__main__":
         test_v4_skill_loader_get_content,
         test_v4_skill_loader_list_skills,
         test_v4_skill_tool_schema,
+        test_v4_glm_skill_cache_outside_workspace,
+        test_v4_glm_skill_content_follows_edits,
+        test_v4_glm_request_prefix_is_stable,
+        test_v4_glm_task_cache,
         # Security tests
         test_v3_safe_path,
         # Config tests
         test_base_url_config,
+        # Bash tool tests
+        test_v1_bash_persistent_shell,
+        test_bash_output_cannot_fake_end_marker,
+        test_v1_edit_file,
+        test_v1_file_cache_is_bounded,
+        test_write_rechecks_symlinks,
+        test_v1_compact_history,
+        test_v2_glm_read_cache,
+        test_v2_glm_large_read_matches_small_read,
+        test_v2_glm_elide_old_tool_results,
+        test_v2_glm_output_store_is_bounded,
+        # Tool scheduling tests
+        test_v1_tools_run_in_call_order,
+        test_v1_glm_tools_run_in_call_order,
+        test_v2_glm_tools_run_in_call_order,
+        test_v3_glm_tools_run_in_call_order,
+        test_v4_glm_tools_run_in_call_order,
+        test_v4_glm_read_cache_drops_reads_racing_a_write,
     ]
 
     failed = []
@@ -48,17 +48,38 @@ Bash 是这个世界的入口：
     python v0_bash_agent.py "探索 src/ 并总结"
 """
 
-from anthropic import Anthropic
-from dotenv import load_dotenv
+import importlib.util
+import os
+import re
+import secrets
+import select
+import shlex
+import signal
 import subprocess
 import sys
-import os
+import time
+
+import httpx
+from anthropic import Anthropic, DefaultHttpxClient
+from dotenv import load_dotenv
 
 load_dotenv(override=True)
 
 # 初始化 Anthropic 客户端（使用 ANTHROPIC_API_KEY 和 ANTHROPIC_BASE_URL 环境变量）
-client = Anthropic(base_url=os.getenv("ANTHROPIC_BASE_URL"))
+# keep-alive 连接池让多轮对话复用同一条 TLS 连接；装了 h2 时启用 HTTP/2
+def _make_client():
+    """创建带连接池的 Anthropic 客户端。"""
+    http_client = DefaultHttpxClient(
+        http2=importlib.util.find_spec("h2") is not None,
+        limits=httpx.Limits(max_keepalive_connections=16, max_connections=32, keepalive_expiry=300),
+        timeout=httpx.Timeout(600.0, connect=5.0),
+    )
+    return Anthropic(base_url=os.getenv("ANTHROPIC_BASE_URL"), http_client=http_client)
+
+
+client = _make_client()
 MODEL = os.getenv("MODEL_ID", "claude-sonnet-4-5-20250929")
+_WORKDIR_STR = os.getcwd()  # 启动时记录一次工作目录，之后不再每次调用 getcwd
 
 # 唯一的工具，可以做任何事情
 # 注意：描述中既教授了模型常用模式，也教了如何生成子代理
@@ -77,7 +98,7 @@ TOOL = [{
 
 # System prompt 教模型如何有效地使用 bash
 # 注意子代理的指导 —— 这是我们实现层级任务分解的方式
-SYSTEM = f"""你是一个位于 {os.getcwd()} 的 CLI 代理。使用 bash 命令解决问题。
+SYSTEM = f"""你是一个位于 {_WORKDIR_STR} 的 CLI 代理。使用 bash 命令解决问题。
 
 规则：
 - 优先使用工具而非文字。先行动，后简要解释。
@@ -94,6 +115,78 @@ SYSTEM = f"""你是一个位于 {os.getcwd()} 的 CLI 代理。使用 bash 命
 子代理在隔离中运行，仅返回最终摘要。"""
 
 
+# 持久 shell：所有命令复用同一个 bash 进程，省掉每次 fork+exec 的开销，
+# 同时保留 cd、export 等状态。首次调用时惰性启动。
+_SHELL = None
+# 结束标记是 __END_<随机数>_<退出码>__，随机数每条命令重新生成：
+# 命令自己的输出里即使出现 __END__ 之类的字样，也不会被误认为结束
+_EXIT_RE = re.compile(rb"\d+__\n")
+
+
+def _find_end(buf, tag):
+    """返回结束标记在 buf 中的位置，没有完整的标记时返回 -1。"""
+    idx = buf.find(tag)
+    if idx >= 0 and _EXIT_RE.match(buf, idx + len(tag)):
+        return idx
+    return -1
+
+
+def run_bash(cmd):
+    """在持久 shell 中执行命令，读到结束标记 __END_<随机数>_<退出码>__ 即返回输出。"""
+    global _SHELL
+    if sys.platform == "win32":
+        # Windows 没有 bash，每次启动一个新进程
+        try:
+            out = subprocess.run(
+                cmd,
+                shell=True,
+                capture_output=True,
+                text=True,
+                timeout=300,
+                cwd=_WORKDIR_STR
+            )
+            return out.stdout + out.stderr
+        except subprocess.TimeoutExpired:
+            return "(300秒后超时)"
+
+    if _SHELL is None or _SHELL.poll() is not None:
+        _SHELL = subprocess.Popen(
+            ["bash", "--noprofile", "--norc"],
+            cwd=_WORKDIR_STR,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            start_new_session=True
+        )
+    tag = f"__END_{secrets.token_hex(8)}_"
+    _SHELL.stdin.write(f"eval {shlex.quote(cmd)} < /dev/null\necho {tag}$?__\n".encode())
+    _SHELL.stdin.flush()
+
+    # 只保留前 50000 字节，之后边读边丢弃，直到读到结束标记；
+    # tail 留着可能被分成两半的标记
+    out, tail, deadline = bytearray(), b"", time.monotonic() + 300
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0 or not select.select([_SHELL.stdout], [], [], remaining)[0]:
+            os.killpg(_SHELL.pid, signal.SIGKILL)  # 连同子进程一起终止，下次重启
+            _SHELL = None
+            return "(300秒后超时)"
+        chunk = os.read(_SHELL.stdout.fileno(), 65536)
+        if not chunk:  # shell 已退出（例如命令中有 exit），下次重启
+            _SHELL.wait()
+            _SHELL = None
+            out += tail[:50000 - len(out)]
+            break
+        tail += chunk
+        end = _find_end(tail, tag.encode())
+        if end >= 0:
+            out += tail[:end][:max(50000 - len(out), 0)]
+            break
+        out += tail[:-64][:max(50000 - len(out), 0)]
+        tail = tail[-64:]
+    return out.decode(errors="replace")
+
+
 def chat(prompt, history=None):
     """
     一个函数中的完整代理循环。
@@ -126,19 +219,8 @@ def chat(prompt, history=None):
             max_tokens=8000
         )
 
-        # 2. 构建助手消息内容（保留 text 和 tool_use 两种 block）
-        content = []
-        for block in response.content:
-            if hasattr(block, "text"):
-                content.append({"type": "text", "text": block.text})
-            elif block.type == "tool_use":
-                content.append({
-                    "type": "tool_use",
-                    "id": block.id,
-                    "name": block.name,
-                    "input": block.input
-                })
-        history.append({"role": "assistant", "content": content})
+        # 2. 保存助手消息（SDK 返回的 block 可以直接放回 messages，无需转成 dict）
+        history.append({"role": "assistant", "content": response.content})
 
         # 3. 如果模型没有调用工具，我们就完成了
         if response.stop_reason != "tool_use":
@@ -151,19 +233,7 @@ def chat(prompt, history=None):
                 cmd = block.input["command"]
                 print(f"\033[33m$ {cmd}\033[0m")  # 黄色显示命令
 
-                try:
-                    out = subprocess.run(
-                        cmd,
-                        shell=True,
-                        capture_output=True,
-                        text=True,
-                        timeout=300,
-                        cwd=os.getcwd()
-                    )
-                    output = out.stdout + out.stderr
-                except subprocess.TimeoutExpired:
-                    output = "(300秒后超时)"
-
+                output = run_bash(cmd)
                 print(output or "(空)")
                 results.append({
                     "type": "tool_result",
@@ -6,9 +6,16 @@ v0_bash_agent_glm.py - Mini Claude Code: Bash 就是一切 (GLM-4 版本)
 使用智谱 GLM-4.7 API 的版本
 """
 
-import sys
-import os
 import json
+import os
+import re
+import secrets
+import select
+import shlex
+import signal
+import subprocess
+import sys
+import time
 
 # 修复 locale 编码问题（macOS/Linux）
 if sys.platform != "win32":
@@ -19,7 +26,13 @@ if sys.platform != "win32":
 
 from openai import OpenAI
 from dotenv import load_dotenv
-import subprocess
+
+# 工具参数解析：装了 orjson 就用它（比标准库快数倍），否则退回 json
+try:
+    import orjson
+    _json_loads = orjson.loads
+except ImportError:
+    _json_loads = json.loads
 
 load_dotenv(override=True)
 
@@ -29,6 +42,7 @@ client = OpenAI(
     base_url=os.getenv("ZHIPU_BASE_URL", "https://open.bigmodel.cn/api/paas/v4")
 )
 MODEL = os.getenv("MODEL_ID", "glm-4.7")
+_WORKDIR_STR = os.getcwd()  # 启动时记录一次工作目录，之后不再每次调用 getcwd
 
 # 唯一的工具，可以做任何事情
 TOOL = {
@@ -48,7 +62,7 @@ TOOL = {
 }
 
 # System prompt
-SYSTEM = f"""你是一个位于 {os.getcwd()} 的 CLI 代理。使用 bash 命令解决问题。
+SYSTEM = f"""你是一个位于 {_WORKDIR_STR} 的 CLI 代理。使用 bash 命令解决问题。
 
 规则：
 - 优先使用工具而非文字。先行动，后简要解释。
@@ -65,12 +79,92 @@ SYSTEM = f"""你是一个位于 {os.getcwd()} 的 CLI 代理。使用 bash 命
 子代理在隔离中运行，仅返回最终摘要。"""
 
 
+# 持久 shell：所有命令复用同一个 bash 进程，省掉每次 fork+exec 的开销，
+# 同时保留 cd、export 等状态。首次调用时惰性启动。
+_SHELL = None
+# 结束标记是 __END_<随机数>_<退出码>__，随机数每条命令重新生成：
+# 命令自己的输出里即使出现 __END__ 之类的字样，也不会被误认为结束
+_EXIT_RE = re.compile(rb"\d+__\n")
+
+
+def _find_end(buf, tag):
+    """返回结束标记在 buf 中的位置，没有完整的标记时返回 -1。"""
+    idx = buf.find(tag)
+    if idx >= 0 and _EXIT_RE.match(buf, idx + len(tag)):
+        return idx
+    return -1
+
+
+def run_bash(cmd):
+    """在持久 shell 中执行命令，读到结束标记 __END_<随机数>_<退出码>__ 即返回输出。"""
+    global _SHELL
+    if sys.platform == "win32":
+        # Windows 没有 bash，每次启动一个新进程
+        try:
+            out = subprocess.run(
+                cmd,
+                shell=True,
+                capture_output=True,
+                text=True,
+                timeout=300,
+                cwd=_WORKDIR_STR
+            )
+            return out.stdout + out.stderr
+        except subprocess.TimeoutExpired:
+            return "(300秒后超时)"
+
+    if _SHELL is None or _SHELL.poll() is not None:
+        _SHELL = subprocess.Popen(
+            ["bash", "--noprofile", "--norc"],
+            cwd=_WORKDIR_STR,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            start_new_session=True
+        )
+    tag = f"__END_{secrets.token_hex(8)}_"
+    _SHELL.stdin.write(f"eval {shlex.quote(cmd)} < /dev/null\necho {tag}$?__\n".encode())
+    _SHELL.stdin.flush()
+
+    # 只保留前 50000 字节，之后边读边丢弃，直到读到结束标记；
+    # tail 留着可能被分成两半的标记
+    out, tail, deadline = bytearray(), b"", time.monotonic() + 300
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0 or not select.select([_SHELL.stdout], [], [], remaining)[0]:
+            os.killpg(_SHELL.pid, signal.SIGKILL)  # 连同子进程一起终止，下次重启
+            _SHELL = None
+            return "(300秒后超时)"
+        chunk = os.read(_SHELL.stdout.fileno(), 65536)
+        if not chunk:  # shell 已退出（例如命令中有 exit），下次重启
+            _SHELL.wait()
+            _SHELL = None
+            out += tail[:50000 - len(out)]
+            break
+        tail += chunk
+        end = _find_end(tail, tag.encode())
+        if end >= 0:
+            out += tail[:end][:max(50000 - len(out), 0)]
+            break
+        out += tail[:-64][:max(50000 - len(out), 0)]
+        tail = tail[-64:]
+    return out.decode(errors="replace")
+
+
+# 所有代理字符（U+D800-U+DFFF）都映射为删除
+_SURROGATE_TBL = dict.fromkeys(range(0xD800, 0xE000))
+
+
 def fix_surrogates(text):
     """修复包含代理字符的字符串"""
     if not text:
         return text
-    # 编码为 utf-8，忽略错误，再解码回来
-    return text.encode('utf-8', errors='ignore').decode('utf-8', errors='ignore')
+    # 绝大多数输入是干净的：一次 encode 检查即可原样返回
+    try:
+        text.encode('utf-8')
+        return text
+    except UnicodeEncodeError:
+        return text.translate(_SURROGATE_TBL)
 
 
 def chat(prompt, history=None):
@@ -83,6 +177,11 @@ def chat(prompt, history=None):
     # 清理输入中的编码问题
     prompt = fix_surrogates(prompt)
 
+    # system 消息只在历史开头放一次，之后原地追加，
+    # 请求前缀保持不变，服务端的自动前缀缓存才能命中
+    if not history:
+        history.append({"role": "system", "content": SYSTEM})
+
     # 添加用户消息
     history.append({"role": "user", "content": prompt})
 
@@ -90,7 +189,7 @@ def chat(prompt, history=None):
         # 1. 调用模型
         response = client.chat.completions.create(
             model=MODEL,
-            messages=[{"role": "system", "content": SYSTEM}] + history,
+            messages=history,
             tools=[TOOL],
             temperature=0.7
         )
@@ -120,24 +219,14 @@ def chat(prompt, history=None):
         # 4. 执行工具调用
         for tool_call in msg.tool_calls:
             func_name = tool_call.function.name
-            func_args = json.loads(tool_call.function.arguments)
+            func_args = _json_loads(tool_call.function.arguments)
 
             if func_name == "bash":
                 cmd = func_args["command"]
                 print(f"\033[33m$ {cmd}\033[0m")
 
                 try:
-                    out = subprocess.run(
-                        cmd,
-                        shell=True,
-                        capture_output=True,
-                        text=True,
-                        timeout=300,
-                        cwd=os.getcwd()
-                    )
-                    output = out.stdout + out.stderr
-                except subprocess.TimeoutExpired:
-                    output = "(300秒后超时)"
+                    output = run_bash(cmd)
                 except Exception as e:
                     output = f"(错误: {e})"
 
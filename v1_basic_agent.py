@@ -46,12 +46,25 @@ Claude Code 有约 20 个工具。但这 4 个覆盖了 90% 的用例：
     python v1_basic_agent.py
 """
 
+import importlib.util
 import os
+import re
+import secrets
+import select
+import shlex
+import signal
 import subprocess
 import sys
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import lru_cache
+from itertools import islice
 from pathlib import Path
 
-from anthropic import Anthropic
+import httpx
+from anthropic import Anthropic, DefaultHttpxClient
 from dotenv import load_dotenv
 
 load_dotenv(override=True)
@@ -63,7 +76,24 @@ load_dotenv(override=True)
 
 WORKDIR = Path.cwd()
 MODEL = os.getenv("MODEL_ID", "claude-sonnet-4-5-20250929")
-client = Anthropic(base_url=os.getenv("ANTHROPIC_BASE_URL"))
+
+
+def _make_client() -> Anthropic:
+    """
+    创建带连接池的客户端。
+
+    keep-alive 让多轮对话复用同一条 TLS 连接，不必每轮重新握手；
+    装了 h2 时启用 HTTP/2，并发请求可以复用同一个连接。
+    """
+    http_client = DefaultHttpxClient(
+        http2=importlib.util.find_spec("h2") is not None,
+        limits=httpx.Limits(max_keepalive_connections=16, max_connections=32, keepalive_expiry=300),
+        timeout=httpx.Timeout(600.0, connect=5.0),
+    )
+    return Anthropic(base_url=os.getenv("ANTHROPIC_BASE_URL"), http_client=http_client)
+
+
+client = _make_client()
 
 
 # =============================================================================
@@ -82,7 +112,7 @@ SYSTEM = f"""你是位于 {WORKDIR} 的编码代理。
 
 
 # =============================================================================
-# 工具定义 - 4 个工具覆盖 90% 的编码任务
+# 工具定义 - 4 个工具覆盖 90% 的编码任务（外加 read_file 的批量版本）
 # =============================================================================
 
 TOOLS = [
@@ -169,6 +199,28 @@ TOOLS = [
             "required": ["path", "old_text", "new_text"],
         },
     },
+
+    # 工具 5: 批量读取 - 一次调用读取多个文件
+    # 探索代码时常常要连读好几个文件，合并成一次调用可以省掉多轮模型往返
+    {
+        "name": "read_files",
+        "description": "一次读取多个文件，结果按文件分段返回。探索代码时优先使用。",
+        "input_schema": {
+            "type": "object",
+            "properties": {
+                "paths": {
+                    "type": "array",
+                    "items": {"type": "string"},
+                    "description": "文件的相对路径列表"
+                },
+                "limit": {
+                    "type": "integer",
+                    "description": "每个文件的最大读取行数（默认：全部）"
+                },
+            },
+            "required": ["paths"],
+        },
+    },
 ]
 
 
@@ -176,19 +228,164 @@ TOOLS = [
 # 工具实现
 # =============================================================================
 
-def safe_path(p: str) -> Path:
+# 工作区根目录只解析一次；结尾带分隔符，前缀比较时 /work 不会误匹配 /work2
+_WORKDIR_RESOLVED = str(WORKDIR.resolve())
+_WORKDIR_PREFIX = os.path.join(_WORKDIR_RESOLVED, "")
+
+
+def _check_path(p: str) -> Path:
     """
     确保路径保持在工作区内（安全措施）。
 
     防止模型访问项目目录之外的文件。
     解析相对路径并检查它们不会通过 '../' 逃逸。
+    用 resolve() 而不是纯字符串的 normpath，这样指向工作区外的符号链接也会被拒绝。
     """
     path = (WORKDIR / p).resolve()
-    if not path.is_relative_to(WORKDIR):
+    resolved = str(path)
+    if resolved != _WORKDIR_RESOLVED and not resolved.startswith(_WORKDIR_PREFIX):
         raise ValueError(f"Path escapes workspace: {p}")
     return path
 
 
+@lru_cache(maxsize=1024)
+def safe_path(p: str) -> Path:
+    """
+    带缓存的 _check_path，供读文件使用。
+
+    resolve() 要逐级 stat 路径，模型又会反复读同一批文件，所以按原始字符串缓存
+    （越界的路径抛异常，不会被缓存）。写文件仍走 _check_path 现场解析，
+    这样之后才出现的符号链接也会被检查到。
+    """
+    return _check_path(p)
+
+
+# 持久 shell：所有 bash 调用复用同一个进程（首次调用时惰性启动）
+_SHELL = None
+_SHELL_LOCK = threading.Lock()  # 工具可能并发执行，但同一时刻只能有一条命令写入 shell
+# 结束标记是 __END_<随机数>_<退出码>__，随机数每条命令重新生成：
+# 命令自己的输出里即使出现 __END__ 之类的字样，也不会被误认为结束
+_EXIT_RE = re.compile(rb"\d+__\n")
+
+
+def _find_end(buf: bytes, tag: bytes) -> int:
+    """返回结束标记在 buf 中的位置，没有完整的标记时返回 -1。"""
+    idx = buf.find(tag)
+    if idx >= 0 and _EXIT_RE.match(buf, idx + len(tag)):
+        return idx
+    return -1
+
+
+def _get_shell() -> subprocess.Popen:
+    """
+    返回持久 bash 进程，不存在或已退出时重新启动。
+
+    每次 subprocess.run 都要 fork+exec 一个新 shell，而代理一轮任务
+    会调用几十次 bash。复用同一个进程省掉这部分开销，
+    同时保留 cd、export、激活的 venv 等 shell 状态。
+    """
+    global _SHELL
+    if _SHELL is None or _SHELL.poll() is not None:
+        _SHELL = subprocess.Popen(
+            ["bash", "--noprofile", "--norc"],
+            cwd=WORKDIR,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            start_new_session=True,  # 独立进程组，超时时可以整组终止
+        )
+    return _SHELL
+
+
+def _kill_shell():
+    """终止持久 shell 及其子进程，下次调用时会重新启动。"""
+    global _SHELL
+    if _SHELL is not None:
+        try:
+            os.killpg(_SHELL.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+        _SHELL.wait()
+        _SHELL = None
+
+
+# 危险命令黑名单编译成一个正则：每次调用只扫描一遍命令
+DANGEROUS = ["rm -rf /", "sudo", "shutdown", "reboot", "> /dev/"]
+_DANGEROUS_RE = re.compile("|".join(map(re.escape, DANGEROUS)))
+
+_OUTPUT_LIMIT = 50000  # 工具输出上限（字节），超出部分不进入上下文
+
+
+def _read_until_marker(shell: subprocess.Popen, tag: bytes, timeout: float):
+    """
+    读取命令输出直到结束标记，最多保留 _OUTPUT_LIMIT 字节。
+
+    超出上限的部分边读边丢弃：仍然要读到标记 shell 才能继续用，
+    但内存占用不再随命令输出（npm install、pytest -v 之类）增长。
+    返回 (输出, 是否截断)，超时返回 None。
+    """
+    fd = shell.stdout.fileno()
+    out = bytearray()
+    tail = b""  # 可能包含半个结束标记的尾部，暂不写入 out
+    truncated = False
+    deadline = time.monotonic() + timeout
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0 or not select.select([fd], [], [], remaining)[0]:
+            return None
+        chunk = os.read(fd, 65536)
+        done = True
+        if not chunk:
+            # shell 已退出（例如命令中有 exit），下次调用时重启
+            _kill_shell()
+            data, tail = tail, b""
+        else:
+            tail += chunk
+            end = _find_end(tail, tag)
+            if end >= 0:
+                data = tail[:end]
+            else:
+                data, tail, done = tail[:-64], tail[-64:], False
+        room = max(_OUTPUT_LIMIT - len(out), 0)
+        if len(data) > room:
+            truncated = True
+        out += data[:room]
+        if done:
+            return bytes(out), truncated
+
+
+def _run_windows(command: str, timeout: float):
+    """
+    Windows 没有 bash：每次启动新进程，读满上限后立即结束它。
+
+    返回 (输出, 是否截断)，超时返回 None。
+    """
+    proc = subprocess.Popen(
+        command,
+        shell=True,
+        cwd=WORKDIR,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        text=True,
+        errors="replace",
+    )
+    deadline = time.monotonic() + timeout
+    timer = threading.Timer(timeout, proc.kill)
+    timer.start()
+    try:
+        out = proc.stdout.read(_OUTPUT_LIMIT + 1)
+        truncated = len(out) > _OUTPUT_LIMIT
+        if truncated:
+            proc.kill()  # 后面的输出用不到了，不必等它跑完
+        proc.wait()
+    finally:
+        timer.cancel()
+        proc.stdout.close()
+    if not truncated and time.monotonic() >= deadline:
+        return None
+    return out[:_OUTPUT_LIMIT], truncated
+
+
 def run_bash(command: str) -> str:
     """
     执行 shell 命令并进行安全检查。
@@ -196,28 +393,92 @@ def run_bash(command: str) -> str:
     安全性：阻止明显的危险命令。
     超时：60 秒以防止挂起。
     输出：截断至 50KB 以防止上下文溢出。
+
+    命令写入持久 bash 进程，后面跟一个结束标记 __END_<随机数>_<退出码>__，
+    读到标记即表示命令执行完毕。
     """
     # 基本安全 - 阻止危险模式
-    dangerous = ["rm -rf /", "sudo", "shutdown", "reboot", "> /dev/"]
-    if any(d in command for d in dangerous):
+    if _DANGEROUS_RE.search(command):
         return "Error: Dangerous command blocked"
 
-    try:
-        result = subprocess.run(
-            command,
-            shell=True,
-            cwd=WORKDIR,
-            capture_output=True,
-            text=True,
-            timeout=60
-        )
-        output = (result.stdout + result.stderr).strip()
-        return output[:50000] if output else "(no output)"
+    # Windows 没有 bash，退回到每次启动一个新进程
+    if sys.platform == "win32":
+        try:
+            result = _run_windows(command, 60)
+        except Exception as e:
+            return f"Error: {e}"
+        if result is None:
+            return "Error: Command timed out (60s)"
+        output, truncated = result
+        output = output.strip()
+        if truncated:
+            output += "\n... (output truncated)"
+        return output or "(no output)"
+
+    with _SHELL_LOCK:
+        try:
+            shell = _get_shell()
+            tag = f"__END_{secrets.token_hex(8)}_"
+            # eval 让语法错误立即报告，而不是吞掉结束标记；
+            # stdin 重定向到 /dev/null，防止命令读走后面的输入
+            shell.stdin.write(
+                f"eval {shlex.quote(command)} < /dev/null\necho {tag}$?__\n".encode()
+            )
+            shell.stdin.flush()
+
+            result = _read_until_marker(shell, tag.encode(), 60)
+            if result is None:
+                _kill_shell()
+                return "Error: Command timed out (60s)"
+
+            buf, truncated = result
+            output = buf.decode(errors="replace").strip()
+            if truncated:
+                output += "\n... (output truncated)"
+            return output or "(no output)"
+
+        except Exception as e:
+            _kill_shell()
+            return f"Error: {e}"
+
+
+# 文件内容缓存：路径 -> ((mtime_ns, size), 文本)
+# read -> edit -> read 是常见模式，文件没变时不必重复读盘；
+# 超过上限时淘汰最久没用过的文件，内存不随读过的文件数增长
+_file_cache: OrderedDict[Path, tuple[tuple[int, int], str]] = OrderedDict()
+_FILE_CACHE_MAX = 256
+_FILE_CACHE_LOCK = threading.Lock()  # 只读工具在线程池里并发执行
+
+
+def _stat_key(fp: Path) -> tuple[int, int]:
+    st = fp.stat()
+    return st.st_mtime_ns, st.st_size
+
+
+def _read_cached(fp: Path) -> str:
+    """读取文件文本；mtime 和大小都没变时直接返回缓存。"""
+    key = _stat_key(fp)
+    with _FILE_CACHE_LOCK:
+        cached = _file_cache.get(fp)
+        if cached and cached[0] == key:
+            _file_cache.move_to_end(fp)
+            return cached[1]
+    text = fp.read_text()
+    _cache_put(fp, key, text)
+    return text
+
+
+def _cache_put(fp: Path, key: tuple[int, int], text: str):
+    with _FILE_CACHE_LOCK:
+        _file_cache[fp] = (key, text)
+        _file_cache.move_to_end(fp)
+        while len(_file_cache) > _FILE_CACHE_MAX:
+            _file_cache.popitem(last=False)
 
-    except subprocess.TimeoutExpired:
-        return "Error: Command timed out (60s)"
-    except Exception as e:
-        return f"Error: {e}"
+
+def _file_cache_drop(fp: Path):
+    with _FILE_CACHE_LOCK:
+        _file_cache.pop(fp, None)
 
 
 def run_read(path: str, limit: int = None) -> str:
@@ -228,19 +489,41 @@ def run_read(path: str, limit: int = None) -> str:
     输出截断至 50KB 以防止上下文溢出。
     """
     try:
-        text = safe_path(path).read_text()
-        lines = text.splitlines()
-
-        if limit and limit < len(lines):
-            lines = lines[:limit]
-            lines.append(f"... ({len(text.splitlines()) - limit} more lines)")
+        fp = safe_path(path)
 
-        return "\n".join(lines)[:50000]
+        if limit:
+            # 只保留前 limit 行，剩下的行只计数不保存
+            with fp.open() as f:
+                out = "".join(islice(f, limit))
+                extra = sum(1 for _ in f)
+            if extra:
+                return (out + f"... ({extra} more lines)")[:50000]
+            return out.removesuffix("\n")[:50000]
+
+        with _FILE_CACHE_LOCK:
+            cached = fp in _file_cache
+        if cached or fp.stat().st_size <= 50000:
+            text = _read_cached(fp)
+        else:
+            # 大文件反正要截断，直接读前 50000 个字符
+            with fp.open() as f:
+                text = f.read(50001)
+        return text.removesuffix("\n")[:50000]
 
     except Exception as e:
         return f"Error: {e}"
 
 
+def run_read_many(paths: list, limit: int = None) -> str:
+    """
+    批量读取多个文件，每个文件一段，总输出同样截断至 50KB。
+
+    单个文件出错只影响它自己那一段。
+    """
+    parts = [f"=== {path} ===\n{run_read(path, limit)}" for path in paths]
+    return "\n\n".join(parts)[:50000]
+
+
 def run_write(path: str, content: str) -> str:
     """
     将内容写入文件，如需要会创建父目录。
@@ -249,8 +532,9 @@ def run_write(path: str, content: str) -> str:
     对于部分编辑，请使用 edit_file。
     """
     try:
-        fp = safe_path(path)
+        fp = _check_path(path)
         fp.parent.mkdir(parents=True, exist_ok=True)
+        _file_cache_drop(fp)
         fp.write_text(content)
         return f"Wrote {len(content)} bytes to {path}"
 
@@ -266,21 +550,34 @@ def run_edit(path: str, old_text: str, new_text: str) -> str:
     仅替换第一次出现以防止意外的大规模更改。
     """
     try:
-        fp = safe_path(path)
-        content = fp.read_text()
+        fp = _check_path(path)
+        content = _read_cached(fp)
 
-        if old_text not in content:
+        # 一次 find 定位，再用切片拼接：只扫描一遍，且只替换第一次出现
+        idx = content.find(old_text)
+        if idx < 0:
             return f"Error: Text not found in {path}"
 
-        # 为安全起见，仅替换第一次出现
-        new_content = content.replace(old_text, new_text, 1)
+        new_content = content[:idx] + new_text + content[idx + len(old_text):]
+        _file_cache_drop(fp)
         fp.write_text(new_content)
+        _cache_put(fp, _stat_key(fp), new_content)
         return f"Edited {path}"
 
     except Exception as e:
         return f"Error: {e}"
 
 
+# 工具名 -> 实现：一次字典查找完成分发
+_DISPATCH = {
+    "bash": lambda args: run_bash(args["command"]),
+    "read_file": lambda args: run_read(args["path"], args.get("limit")),
+    "read_files": lambda args: run_read_many(args["paths"], args.get("limit")),
+    "write_file": lambda args: run_write(args["path"], args["content"]),
+    "edit_file": lambda args: run_edit(args["path"], args["old_text"], args["new_text"]),
+}
+
+
 def execute_tool(name: str, args: dict) -> str:
     """
     将工具调用分发到相应的实现。
@@ -288,21 +585,131 @@ def execute_tool(name: str, args: dict) -> str:
     这是模型的工具调用与实际执行之间的桥梁。
     每个工具返回一个字符串结果，该结果会返回给模型。
     """
-    if name == "bash":
-        return run_bash(args["command"])
-    if name == "read_file":
-        return run_read(args["path"], args.get("limit"))
-    if name == "write_file":
-        return run_write(args["path"], args["content"])
-    if name == "edit_file":
-        return run_edit(args["path"], args["old_text"], args["new_text"])
-    return f"Unknown tool: {name}"
+    handler = _DISPATCH.get(name)
+    if handler is None:
+        return f"Unknown tool: {name}"
+    return handler(args)
+
+
+# =============================================================================
+# 提示词缓存
+# =============================================================================
+
+# system 是固定前缀，标记后每次请求都能命中服务端缓存
+_SYSTEM_BLOCKS = ({"type": "text", "text": SYSTEM, "cache_control": {"type": "ephemeral"}},)
+
+# 每轮请求中不变的参数只构造一次。SDK 没有接收预编码 JSON 的入口，
+# 所以这里只省掉每轮重建参数，并用元组防止运行中被意外修改（那会让缓存前缀失效）。
+_STATIC_PARAMS = {
+    "model": MODEL,
+    "system": _SYSTEM_BLOCKS,
+    "tools": tuple(TOOLS),
+    "max_tokens": 8000,
+}
+
+# 上一次打了缓存断点的 tool_result 块。
+# API 最多允许 4 个断点，所以断点随对话向后移动，而不是每轮都新增一个。
+_cache_block = None
+
+
+def _move_cache_breakpoint(block: dict):
+    """把缓存断点移到最新的 tool_result 上，下一轮即可复用之前的全部上下文。"""
+    global _cache_block
+    if _cache_block is not None:
+        _cache_block.pop("cache_control", None)
+    block["cache_control"] = {"type": "ephemeral"}
+    _cache_block = block
+
+
+# =============================================================================
+# 历史压缩
+# =============================================================================
+
+# 消息数超过 MAX_HISTORY 时，把较早的部分折叠成一条摘要，只保留最近 KEEP_RECENT 条原文。
+# 否则每轮请求都要重新上传整个历史，成本随轮数平方增长。
+MAX_HISTORY = 40
+KEEP_RECENT = 20
+_SUMMARY_TAG = "[summary of prior steps]"
+
+
+def _field(block, key: str):
+    """同时兼容 SDK 返回的对象和我们自己构造的 dict。"""
+    return block.get(key) if isinstance(block, dict) else getattr(block, key, None)
+
+
+def _summarize(messages: list) -> str:
+    """把一段历史压成简短的文本：每一步只留前 200 个字符。"""
+    lines = []
+    for msg in messages:
+        content = msg["content"]
+        if isinstance(content, str):
+            # 上一次压缩留下的摘要原样保留
+            lines.append(content if content.startswith(_SUMMARY_TAG) else f"{msg['role']}: {content[:200]}")
+            continue
+        for block in content:
+            kind = _field(block, "type")
+            if kind == "text":
+                lines.append(f"assistant: {_field(block, 'text')[:200]}")
+            elif kind == "tool_use":
+                lines.append(f"> {_field(block, 'name')}: {str(_field(block, 'input'))[:200]}")
+            elif kind == "tool_result":
+                lines.append(f"  {str(_field(block, 'content'))[:200]}")
+    return "\n".join(lines)[-8000:]
+
+
+def compact_history(messages: list):
+    """
+    原地压缩历史：较早的消息替换为开头的一条摘要。
+
+    切点选在 assistant 消息上，保证 tool_use 和对应的 tool_result
+    不会被拆开，并且摘要（user）之后仍然是 user/assistant 交替。
+    """
+    if len(messages) <= MAX_HISTORY:
+        return
+    cut = len(messages) - KEEP_RECENT
+    while cut < len(messages) and messages[cut]["role"] != "assistant":
+        cut += 1
+    if cut >= len(messages):
+        return
+    summary = _summarize(messages[:cut])
+    messages[:cut] = [{"role": "user", "content": f"{_SUMMARY_TAG}\n{summary}"}]
 
 
 # =============================================================================
 # 代理循环 - 这是一切的核心
 # =============================================================================
 
+# 工具执行专用线程池：整个进程复用，不必每轮新建线程；
+# 工具几乎都是磁盘/子进程 I/O，线程数可以比 CPU 核数多
+_IO_POOL = ThreadPoolExecutor(max_workers=16, thread_name_prefix="agent-io")
+
+# 只读工具可以并发；其余工具会改动工作区，必须按调用顺序逐个执行
+_READ_ONLY_TOOLS = frozenset(("read_file", "read_files"))
+
+
+class _DeferredCall(Future):
+    """
+    推迟到取结果时才执行的工具调用。
+
+    bash、write_file、edit_file 不能并发：同一文件的两次 edit 会互相覆盖
+    （_file_cache 也会留下过期内容），write 之后的 bash 也可能先于写入运行。
+    agent_loop 按原始顺序取结果，在 result() 里执行，
+    就保证它们按调用顺序、在之前的调用都结束后逐个运行。
+    """
+
+    def __init__(self, name: str, args: dict):
+        super().__init__()
+        self._call = (name, args)
+
+    def result(self, timeout=None):
+        if not self.done():
+            try:
+                self.set_result(execute_tool(*self._call))
+            except Exception as e:
+                self.set_exception(e)
+        return super().result(timeout)
+
+
 def agent_loop(messages: list) -> list:
     """
     一个函数中的完整代理。
@@ -325,36 +732,52 @@ def agent_loop(messages: list) -> list:
       3. 对话历史在轮次之间维护上下文
     """
     while True:
-        # 步骤 1: 调用模型
-        response = client.messages.create(
-            model=MODEL,
-            system=SYSTEM,
-            messages=messages,
-            tools=TOOLS,
-            max_tokens=8000,
-        )
-
-        # 步骤 2: 收集任何工具调用并打印文本输出
-        tool_calls = []
-        for block in response.content:
-            if hasattr(block, "text"):
-                print(block.text)
-            if block.type == "tool_use":
-                tool_calls.append(block)
-
-        # 步骤 3: 如果没有工具调用，任务完成
+        compact_history(messages)
+
+        # 步骤 1: 流式调用模型
+        # 文本边生成边打印；只读的 tool_use 块一结束就提交到 _IO_POOL 执行，
+        # 不必等整条响应生成完。多个独立的读取因此并发执行，
+        # 一轮的耗时从各工具耗时之和降到最慢的那一个。
+        # 第一个会改动工作区的调用及其后的所有调用推迟到步骤 3 按顺序执行。
+        futures = {}
+        ordered = False
+        with client.messages.stream(messages=messages, **_STATIC_PARAMS) as stream:
+            for event in stream:
+                if event.type == "text":
+                    print(event.text, end="", flush=True)
+                elif event.type == "content_block_stop":
+                    block = event.content_block
+                    if block.type == "text":
+                        print()
+                    elif block.type == "tool_use":
+                        ordered = ordered or block.name not in _READ_ONLY_TOOLS
+                        if ordered:
+                            futures[block.id] = _DeferredCall(block.name, block.input)
+                        else:
+                            futures[block.id] = _IO_POOL.submit(
+                                execute_tool, block.name, block.input
+                            )
+            response = stream.get_final_message()
+
+        # 步骤 2: 如果没有工具调用，任务完成
         if response.stop_reason != "tool_use":
             messages.append({"role": "assistant", "content": response.content})
             return messages
 
-        # 步骤 4: 执行每个工具并收集结果
+        # 步骤 3: 按原始顺序收集每个工具的结果（推迟的调用在这里依次执行）
         results = []
-        for tc in tool_calls:
+        for tc in response.content:
+            if tc.type != "tool_use":
+                continue
+
             # 显示正在执行的内容
             print(f"\n> {tc.name}: {tc.input}")
 
-            # 执行并显示结果预览
-            output = execute_tool(tc.name, tc.input)
+            # 等待结果并显示预览；单个工具失败不影响同批其他工具
+            try:
+                output = futures[tc.id].result()
+            except Exception as e:
+                output = f"Error: {e}"
             preview = output[:200] + "..." if len(output) > 200 else output
             print(f"  {preview}")
 
@@ -365,10 +788,11 @@ def agent_loop(messages: list) -> list:
                 "content": output,
             })
 
-        # 步骤 5: 追加到对话并继续
+        # 步骤 4: 追加到对话并继续
         # 注意：我们先追加助手的响应，然后是用户的工具结果
         # 这保持了用户/助手交替的模式
         messages.append({"role": "assistant", "content": response.content})
+        _move_cache_breakpoint(results[-1])
         messages.append({"role": "user", "content": results})
 
 
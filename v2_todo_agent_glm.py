@@ -59,10 +59,26 @@ Todo 约束（最多项、一个进行中）使能（可见计划、跟踪进度
     python v2_todo_agent_glm.py
 """
 
+import importlib.util
 import os
+import re
 import sys
 import json
+import time
+import shlex
+import secrets
+import select
+import signal
+import threading
+import atexit
+import hashlib
+import mmap
+import shelve
 import subprocess
+from collections import OrderedDict
+from functools import lru_cache
+from itertools import islice
+from concurrent.futures import Future, ThreadPoolExecutor
 from pathlib import Path
 
 # 修复 locale 编码问题（macOS/Linux）
@@ -72,9 +88,24 @@ if sys.platform != "win32":
         os.environ["LANG"] = "en_US.UTF-8"
         os.environ["LC_ALL"] = "en_US.UTF-8"
 
-from openai import OpenAI
+import httpx
+from openai import DefaultHttpxClient, OpenAI
 from dotenv import load_dotenv
 
+# JSON 编解码：装了 orjson 就用它（比标准库快数倍），否则退回 json。
+# _json_dumps_sorted 两条路径输出相同的紧凑字节，缓存键不受是否安装 orjson 影响
+try:
+    import orjson
+    _json_loads = orjson.loads
+
+    def _json_dumps_sorted(obj) -> bytes:
+        return orjson.dumps(obj, option=orjson.OPT_SORT_KEYS)
+except ImportError:
+    _json_loads = json.loads
+
+    def _json_dumps_sorted(obj) -> bytes:
+        return json.dumps(obj, sort_keys=True, ensure_ascii=False, separators=(",", ":")).encode()
+
 load_dotenv(override=True)
 
 
@@ -83,17 +114,28 @@ load_dotenv(override=True)
 # =============================================================================
 
 WORKDIR = Path.cwd()
+# 复用连接池：keep-alive 让多轮对话共用同一条 TLS 连接；装了 h2 时启用 HTTP/2
 client = OpenAI(
     api_key=os.getenv("ZHIPU_API_KEY", "your_api_key_here"),
-    base_url=os.getenv("ZHIPU_BASE_URL", "https://open.bigmodel.cn/api/paas/v4")
+    base_url=os.getenv("ZHIPU_BASE_URL", "https://open.bigmodel.cn/api/paas/v4"),
+    http_client=DefaultHttpxClient(
+        http2=importlib.util.find_spec("h2") is not None,
+        limits=httpx.Limits(max_keepalive_connections=32, max_connections=64, keepalive_expiry=60.0),
+        timeout=httpx.Timeout(120.0, connect=10.0),
+    ),
 )
 MODEL = os.getenv("MODEL_ID", "glm-4.7")
+TEMPERATURE = float(os.getenv("TEMPERATURE", "0.7"))
 
 
 # =============================================================================
 # TodoManager - v2 的核心新增内容
 # =============================================================================
 
+_VALID_STATUS = frozenset(("pending", "in_progress", "completed"))
+_MARKS = {"completed": "[x]", "in_progress": "[>]", "pending": "[ ]"}
+
+
 class TodoManager:
     """
     管理带有强制约束的结构化任务列表。
@@ -131,6 +173,10 @@ class TodoManager:
         返回:
             todo 列表的渲染文本视图
         """
+        # 强制约束：数量在循环前检查，in_progress 在同一遍里检查，发现违规立即返回
+        if len(items) > 20:
+            raise ValueError("最多允许 20 个 todos")
+
         validated = []
         in_progress_count = 0
 
@@ -143,13 +189,15 @@ class TodoManager:
             # 验证检查
             if not content:
                 raise ValueError(f"第 {i} 项: content 是必需的")
-            if status not in ("pending", "in_progress", "completed"):
+            if status not in _VALID_STATUS:
                 raise ValueError(f"第 {i} 项: 无效的 status '{status}'")
             if not active_form:
                 raise ValueError(f"第 {i} 项: activeForm 是必需的")
 
             if status == "in_progress":
                 in_progress_count += 1
+                if in_progress_count > 1:
+                    raise ValueError("一次只能有一个任务处于 in_progress 状态")
 
             validated.append({
                 "content": content,
@@ -157,12 +205,6 @@ class TodoManager:
                 "activeForm": active_form
             })
 
-        # 强制约束
-        if len(validated) > 20:
-            raise ValueError("最多允许 20 个 todos")
-        if in_progress_count > 1:
-            raise ValueError("一次只能有一个任务处于 in_progress 状态")
-
         self.items = validated
         return self.render()
 
@@ -183,16 +225,13 @@ class TodoManager:
         if not self.items:
             return "没有 todos。"
 
-        lines = []
-        for item in self.items:
-            if item["status"] == "completed":
-                lines.append(f"[x] {item['content']}")
-            elif item["status"] == "in_progress":
-                lines.append(f"[>] {item['content']} <- {item['activeForm']}")
-            else:
-                lines.append(f"[ ] {item['content']}")
+        lines = [
+            f"{_MARKS[item['status']]} {item['content']}"
+            + (f" <- {item['activeForm']}" if item["status"] == "in_progress" else "")
+            for item in self.items
+        ]
 
-        completed = sum(1 for t in self.items if t["status"] == "completed")
+        completed = sum(item["status"] == "completed" for item in self.items)
         lines.append(f"\n({completed}/{len(self.items)} 已完成)")
 
         return "\n".join(lines)
@@ -214,8 +253,11 @@ SYSTEM = f"""你是位于 {WORKDIR} 的编码代理。
 - 使用 TodoWrite 跟踪多步任务
 - 开始前标记任务为 in_progress，完成后标记为 completed
 - 优先使用工具而非文字。行动，而不只是解释。
+- 较早的大段工具输出会被替换为 <tool_output id=...> 句柄，需要时用 read_output 取回
 - 完成后，总结更改内容。"""
 
+_SYSTEM_MSG = {"role": "system", "content": SYSTEM}
+
 
 # =============================================================================
 # 系统提醒 - 软提示鼓励 todo 使用
@@ -226,13 +268,16 @@ INITIAL_REMINDER = "<reminder>对多步任务使用 TodoWrite。</reminder>"
 
 # 如果模型有一段时间没有更新 todos，则显示
 NAG_REMINDER = "<reminder>10+ 轮没有 todo 更新。请更新 todos。</reminder>"
+# 提醒只附在当次请求末尾，不写入历史
+_NAG_MSG = {"role": "system", "content": NAG_REMINDER}
 
 
 # =============================================================================
 # 工具定义 (v1 工具 + TodoWrite)
 # =============================================================================
 
-TOOLS = [
+# 用元组冻结：每次请求传同一个对象，序列化结果逐字节一致，前缀缓存才能命中
+TOOLS = (
     # v1 工具（未改变）
     {
         "type": "function",
@@ -357,65 +402,277 @@ TOOLS = [
             },
         }
     },
-]
+
+    # 取回被压缩的旧工具输出（见 elide_old_tool_results）
+    {
+        "type": "function",
+        "function": {
+            "name": "read_output",
+            "description": "按句柄读取之前被压缩的工具输出。",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "handle": {
+                        "type": "string",
+                        "description": "<tool_output id=...> 中的 id"
+                    },
+                    "offset": {
+                        "type": "integer",
+                        "description": "起始字符位置（默认 0）"
+                    },
+                    "size": {
+                        "type": "integer",
+                        "description": "读取的字符数（默认 8000）"
+                    }
+                },
+                "required": ["handle"],
+            },
+        }
+    },
+)
 
 
 # =============================================================================
 # 工具实现 (v1 + TodoWrite)
 # =============================================================================
 
-def safe_path(p: str) -> Path:
+# 工作区根目录只解析一次；结尾带分隔符，前缀比较时 /work 不会误匹配 /work2
+_WORKDIR_RESOLVED = str(WORKDIR.resolve())
+_WORKDIR_PREFIX = os.path.join(_WORKDIR_RESOLVED, "")
+
+
+def _check_path(p: str) -> Path:
     """确保路径保持在工作区内（安全措施）。"""
     path = (WORKDIR / p).resolve()
-    if not path.is_relative_to(WORKDIR):
+    resolved = str(path)
+    if resolved != _WORKDIR_RESOLVED and not resolved.startswith(_WORKDIR_PREFIX):
         raise ValueError(f"路径逃逸工作区: {p}")
     return path
 
 
+@lru_cache(maxsize=512)
+def safe_path(p: str) -> Path:
+    """
+    带缓存的 _check_path，供读文件使用。
+
+    resolve() 要逐级 stat 路径，模型又会反复读同一批文件，所以按原始字符串缓存
+    （越界的路径抛异常，不会被缓存）。写文件仍走 _check_path 现场解析，
+    这样之后才出现的符号链接也会被检查到。
+    """
+    return _check_path(p)
+
+
+# 持久 shell：所有 bash 调用复用同一个进程（首次调用时惰性启动），
+# 省掉每条命令 fork+exec 一个新 shell 的开销，同时保留 cd、export 等状态
+_SHELL = None
+_SHELL_LOCK = threading.Lock()  # 工具可能并发执行，但同一时刻只能有一条命令写入 shell
+# 结束标记是 __END_<随机数>_<退出码>__，随机数每条命令重新生成：
+# 命令自己的输出里即使出现 __END__ 之类的字样，也不会被误认为结束
+_EXIT_RE = re.compile(rb"\d+__\n")
+
+
+def _find_end(buf: bytes, tag: bytes) -> int:
+    """返回结束标记在 buf 中的位置，没有完整的标记时返回 -1。"""
+    idx = buf.find(tag)
+    if idx >= 0 and _EXIT_RE.match(buf, idx + len(tag)):
+        return idx
+    return -1
+
+
+def _get_shell() -> subprocess.Popen:
+    """返回持久 bash 进程，不存在或已退出时重新启动。"""
+    global _SHELL
+    if _SHELL is None or _SHELL.poll() is not None:
+        _SHELL = subprocess.Popen(
+            ["bash", "--noprofile", "--norc"],
+            cwd=WORKDIR,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            start_new_session=True,  # 独立进程组，超时时可以整组终止
+        )
+    return _SHELL
+
+
+def _kill_shell():
+    """终止持久 shell 及其子进程，下次调用时会重新启动。"""
+    global _SHELL
+    if _SHELL is not None:
+        try:
+            os.killpg(_SHELL.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+        _SHELL.wait()
+        _SHELL = None
+
+
+_OUTPUT_LIMIT = 50000  # 工具输出上限（字节），超出部分不进入上下文
+
+
+def _read_until_marker(shell: subprocess.Popen, tag: bytes, timeout: float):
+    """
+    读取命令输出直到结束标记，最多保留 _OUTPUT_LIMIT 字节，超出部分边读边丢弃。
+
+    返回 (输出, 是否截断)，超时返回 None。
+    """
+    fd = shell.stdout.fileno()
+    out = bytearray()
+    tail = b""  # 可能包含半个结束标记的尾部，暂不写入 out
+    truncated = False
+    deadline = time.monotonic() + timeout
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0 or not select.select([fd], [], [], remaining)[0]:
+            return None
+        chunk = os.read(fd, 65536)
+        done = True
+        if not chunk:
+            # shell 已退出（例如命令中有 exit），下次调用时重启
+            _kill_shell()
+            data, tail = tail, b""
+        else:
+            tail += chunk
+            end = _find_end(tail, tag)
+            if end >= 0:
+                data = tail[:end]
+            else:
+                data, tail, done = tail[:-64], tail[-64:], False
+        room = max(_OUTPUT_LIMIT - len(out), 0)
+        if len(data) > room:
+            truncated = True
+        out += data[:room]
+        if done:
+            return bytes(out), truncated
+
+
+# Windows 命令转换（模型习惯用 Unix 命令）：一个正则匹配命令开头，再查表替换
+_WIN_CMD_MAP = {
+    "ls": "dir",
+    "cat": "type",
+    "grep": "findstr",
+    "rm": "del",
+    "mv": "move",
+    "cp": "copy",
+    "pwd": "cd",
+}
+_WIN_CMD_RE = re.compile(r"^\s*(ls|cat|grep|rm|mv|cp|pwd)(?=\s|$)")
+
+# 危险命令黑名单编译成一个正则：每次调用只扫描一遍命令
+DANGEROUS = ["rm -rf /", "sudo", "shutdown", "reboot"]
+_DANGEROUS_RE = re.compile("|".join(map(re.escape, DANGEROUS)))
+
+
 def run_bash(cmd: str) -> str:
     """执行 shell 命令并进行安全检查。"""
-    dangerous = ["rm -rf /", "sudo", "shutdown", "reboot"]
-    if any(d in cmd for d in dangerous):
+    if _DANGEROUS_RE.search(cmd):
         return "错误: 危险命令被阻止"
 
-    # Windows 命令转换（模型习惯用 Unix 命令）
+    # Windows 没有 bash，每次启动一个新进程
     if sys.platform == "win32":
-        # 将常见 Unix 命令转换为 Windows 等效命令
-        cmd_map = {
-            "ls": "dir",
-            "cat": "type",
-            "grep": "findstr",
-            "rm": "del",
-            "mv": "move",
-            "cp": "copy",
-            "pwd": "cd",
-        }
-        # 简单替换（只替换命令开头的）
-        for unix_cmd, win_cmd in cmd_map.items():
-            if cmd.strip().startswith(unix_cmd + " ") or cmd.strip() == unix_cmd:
-                cmd = cmd.replace(unix_cmd, win_cmd, 1)
-                break
+        # 将常见 Unix 命令转换为 Windows 等效命令（只替换命令开头的）
+        cmd = _WIN_CMD_RE.sub(lambda m: _WIN_CMD_MAP[m.group(1)], cmd, count=1)
+        try:
+            result = subprocess.run(
+                cmd, shell=True, cwd=WORKDIR,
+                capture_output=True, text=True, timeout=60
+            )
+            output = (result.stdout + result.stderr).strip()
+            return output[:50000] if output else "(无输出)"
+        except subprocess.TimeoutExpired:
+            return "错误: 超时"
+        except Exception as e:
+            return f"错误: {e}"
+
+    with _SHELL_LOCK:
+        try:
+            shell = _get_shell()
+            tag = f"__END_{secrets.token_hex(8)}_"
+            # eval 让语法错误立即报告，而不是吞掉结束标记；
+            # stdin 重定向到 /dev/null，防止命令读走后面的输入
+            shell.stdin.write(
+                f"eval {shlex.quote(cmd)} < /dev/null\necho {tag}$?__\n".encode()
+            )
+            shell.stdin.flush()
+
+            result = _read_until_marker(shell, tag.encode(), 60)
+            if result is None:
+                _kill_shell()
+                return "错误: 超时"
+
+            buf, truncated = result
+            output = buf.decode(errors="replace").strip()
+            if truncated:
+                output += "\n...(输出已截断)"
+            return output or "(无输出)"
+        except Exception as e:
+            _kill_shell()
+            return f"错误: {e}"
+
+
+# 读缓存：路径 -> ((mtime_ns, size), 行列表)。同一文件反复读取时，
+# 只要 stat 没变就不再碰磁盘、也不再 splitlines。只缓存不超过 _LARGE_FILE 的文件
+# （更大的走 _read_large），超过上限时淘汰最久没用过的文件
+_READ_CACHE: OrderedDict = OrderedDict()
+_READ_CACHE_MAX = 256
+_READ_CACHE_LOCK = threading.Lock()  # 只读工具在线程池里并发执行
+_LARGE_FILE = 50000
+
+
+def _read_lines(fp: Path, st: os.stat_result) -> list:
+    """读取文件的行列表；mtime 和大小都没变时直接返回缓存。"""
+    key = (st.st_mtime_ns, st.st_size)
+    with _READ_CACHE_LOCK:
+        cached = _READ_CACHE.get(str(fp))
+        if cached and cached[0] == key:
+            _READ_CACHE.move_to_end(str(fp))
+            return cached[1]
+    lines = fp.read_text(encoding="utf-8").splitlines()
+    with _READ_CACHE_LOCK:
+        _READ_CACHE[str(fp)] = (key, lines)
+        _READ_CACHE.move_to_end(str(fp))
+        while len(_READ_CACHE) > _READ_CACHE_MAX:
+            _READ_CACHE.popitem(last=False)
+    return lines
+
+
+def _read_cache_drop(fp: Path):
+    with _READ_CACHE_LOCK:
+        _READ_CACHE.pop(str(fp), None)
 
-    try:
-        result = subprocess.run(
-            cmd, shell=True, cwd=WORKDIR,
-            capture_output=True, text=True, timeout=60
-        )
-        output = (result.stdout + result.stderr).strip()
-        return output[:50000] if output else "(无输出)"
-    except subprocess.TimeoutExpired:
-        return "错误: 超时"
-    except Exception as e:
-        return f"错误: {e}"
+
+_COUNT_CHUNK = 1 << 20
+
+
+def _read_large(fp: Path, limit: int = None) -> str:
+    """
+    大文件不整体读入：只解码需要的部分。
+
+    用文本模式打开：增量 UTF-8 解码不会切断多字节字符，CRLF 换行也和 read_text 一样转换，
+    再 splitlines，所以同一个文件不论大小读出来的文本都相同。
+    行数用 mmap 按 1MB 分块 bytes.count 统计（底层是 memchr），不必解码整个文件。
+    """
+    with open(fp, encoding="utf-8") as f:
+        if not limit:
+            return "\n".join(f.read(_LARGE_FILE + 1).splitlines())[:50000]
+        lines = "".join(islice(f, limit)).splitlines()[:limit]
+    with open(fp, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        total = sum(mm[i:i + _COUNT_CHUNK].count(b"\n") for i in range(0, len(mm), _COUNT_CHUNK))
+        total += mm[-1:] != b"\n"
+    if limit < total:
+        lines.append(f"... ({total - limit} 更多行)")
+    return "\n".join(lines)[:50000]
 
 
 def run_read(path: str, limit: int = None) -> str:
     """读取文件内容。"""
     try:
-        text = safe_path(path).read_text()
-        lines = text.splitlines()
+        fp = safe_path(path)
+        st = fp.stat()
+        if st.st_size > _LARGE_FILE:
+            return _read_large(fp, limit)
+        lines = _read_lines(fp, st)
         if limit and limit < len(lines):
-            lines = lines[:limit] + [f"... ({len(text.splitlines()) - limit} 更多行)"]
+            lines = lines[:limit] + [f"... ({len(lines) - limit} 更多行)"]
         return "\n".join(lines)[:50000]
     except Exception as e:
         return f"错误: {e}"
@@ -424,8 +681,9 @@ def run_read(path: str, limit: int = None) -> str:
 def run_write(path: str, content: str) -> str:
     """将内容写入文件。"""
     try:
-        fp = safe_path(path)
+        fp = _check_path(path)
         fp.parent.mkdir(parents=True, exist_ok=True)
+        _read_cache_drop(fp)
         fp.write_text(content)
         return f"写入 {len(content)} 字节到 {path}"
     except Exception as e:
@@ -435,11 +693,15 @@ def run_write(path: str, content: str) -> str:
 def run_edit(path: str, old_text: str, new_text: str) -> str:
     """替换文件中的精确文本。"""
     try:
-        fp = safe_path(path)
-        content = fp.read_text()
-        if old_text not in content:
+        fp = _check_path(path)
+        content = fp.read_text()  # 编辑不经过读缓存：改完旧内容就没用了
+
+        # 一次 find 定位，再用切片拼接：只扫描一遍，且只替换第一次出现
+        idx = content.find(old_text)
+        if idx < 0:
             return f"错误: 在 {path} 中未找到文本"
-        fp.write_text(content.replace(old_text, new_text, 1))
+        _read_cache_drop(fp)
+        fp.write_text(content[:idx] + new_text + content[idx + len(old_text):])
         return f"已编辑 {path}"
     except Exception as e:
         return f"错误: {e}"
@@ -458,6 +720,43 @@ def run_todo(items: list) -> str:
         return f"错误: {e}"
 
 
+# 被压缩的旧工具输出：句柄（内容哈希）-> 完整文本，模型需要时用 read_output 取回。
+# 总字符数超过 OUTPUT_STORE_MAX_CHARS 时淘汰最久没用过的输出，长会话里内存不会一直增长
+_OUTPUT_STORE: OrderedDict = OrderedDict()
+_OUTPUT_STORE_LOCK = threading.Lock()  # 压缩在后台线程里做，read_output 在线程池里执行
+OUTPUT_STORE_MAX_CHARS = int(os.getenv("OUTPUT_STORE_MAX_CHARS", str(16 * 1024 * 1024)))
+_output_store_chars = 0
+
+
+def _store_output(handle: str, content: str):
+    """存入一条被压缩的输出，超出容量时从最旧的开始淘汰。"""
+    global _output_store_chars
+    with _OUTPUT_STORE_LOCK:
+        if handle in _OUTPUT_STORE:
+            _OUTPUT_STORE.move_to_end(handle)
+            return
+        _OUTPUT_STORE[handle] = content
+        _output_store_chars += len(content)
+        while _output_store_chars > OUTPUT_STORE_MAX_CHARS and len(_OUTPUT_STORE) > 1:
+            _output_store_chars -= len(_OUTPUT_STORE.popitem(last=False)[1])
+
+
+def run_read_output(handle: str, offset: int = 0, size: int = 8000) -> str:
+    """读取已存储工具输出的一段。"""
+    with _OUTPUT_STORE_LOCK:
+        output = _OUTPUT_STORE.get(handle)
+        if output is not None:
+            _OUTPUT_STORE.move_to_end(handle)
+    if output is None:
+        return f"错误: 输出 {handle} 不在存储中（句柄无效，或已因容量上限被淘汰），需要时请重新运行原来的命令"
+    offset = max(offset or 0, 0)
+    size = min(max(size or 8000, 1), 50000)
+    chunk = output[offset:offset + size]
+    if offset + size < len(output):
+        chunk += f"\n... (共 {len(output)} 字符，下一段从 offset={offset + size} 开始)"
+    return chunk
+
+
 def execute_tool(name: str, args: dict) -> str:
     """将工具调用分发到相应的实现。"""
     if name == "bash":
@@ -470,9 +769,161 @@ def execute_tool(name: str, args: dict) -> str:
         return run_edit(args["path"], args["old_text"], args["new_text"])
     if name == "TodoWrite":
         return run_todo(args["items"])
+    if name == "read_output":
+        return run_read_output(args["handle"], args.get("offset", 0), args.get("size", 8000))
     return f"未知工具: {name}"
 
 
+# =============================================================================
+# LLM 响应缓存 - 相同请求直接复用上次的响应
+# =============================================================================
+
+# 只在结果确定（temperature == 0）或显式要求重放（LLM_CACHE_FORCE=1）时启用。
+# shelve 底层是 pickle，读入不可信的文件等于执行任意代码：默认放在用户自己的缓存目录
+# （按工作区路径区分），而不是工作区里——克隆来的仓库可能自带一个 .llm_cache
+def _default_llm_cache_path() -> str:
+    """~/.cache/mini-claude-code/llm-<工作区路径哈希>（Windows 在 LOCALAPPDATA 下）。"""
+    if sys.platform == "win32":
+        base = os.getenv("LOCALAPPDATA") or Path.home() / "AppData" / "Local"
+    else:
+        base = os.getenv("XDG_CACHE_HOME") or Path.home() / ".cache"
+    workspace = hashlib.sha256(str(WORKDIR.resolve()).encode()).hexdigest()[:16]
+    return str(Path(base) / "mini-claude-code" / f"llm-{workspace}")
+
+
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH") or _default_llm_cache_path()
+LLM_CACHE_TTL = int(os.getenv("LLM_CACHE_TTL", "86400"))  # 秒
+LLM_CACHE_FORCE = os.getenv("LLM_CACHE_FORCE") == "1"
+
+_cache_db = None
+cache_stats = {"hits": 0, "misses": 0}
+
+
+# 模型和工具定义在进程内不变：启动时序列化一次并喂进哈希，
+# 之后每个请求只 copy() 这个状态，再追加消息和温度
+_TOOLS_JSON = _json_dumps_sorted(TOOLS)
+_KEY_PREFIX = hashlib.sha256(_json_dumps_sorted(MODEL) + _TOOLS_JSON)
+
+
+def _cache_key(messages: list, temperature: float) -> str:
+    """请求指纹：模型、消息、工具和温度完全相同才算同一个请求。"""
+    h = _KEY_PREFIX.copy()
+    h.update(_json_dumps_sorted({"messages": messages, "temperature": temperature}))
+    return h.hexdigest()
+
+
+def _cache_open():
+    """首次使用时打开缓存文件，进程退出时关闭。"""
+    global _cache_db
+    if _cache_db is None:
+        Path(LLM_CACHE_PATH).parent.mkdir(parents=True, exist_ok=True)
+        _cache_db = shelve.open(LLM_CACHE_PATH)
+        atexit.register(_cache_db.close)
+    return _cache_db
+
+
+def cache_get(key: str):
+    """取出未过期的助手消息，没有则返回 None。"""
+    entry = _cache_open().get(key)
+    if entry and time.time() - entry["time"] < LLM_CACHE_TTL:
+        cache_stats["hits"] += 1
+        return entry["message"]
+    cache_stats["misses"] += 1
+    return None
+
+
+def cache_put(key: str, assistant_msg: dict):
+    _cache_open()[key] = {"time": time.time(), "message": assistant_msg}
+
+
+# =============================================================================
+# 历史压缩 - 旧的大段工具输出只保留开头
+# =============================================================================
+
+# 每轮都会重发整个历史；几轮之前的 bash/read_file 大输出模型已经用过了，
+# 留着只会让每次请求的字节数越滚越大。完整内容按哈希存进 _OUTPUT_STORE，
+# 历史里只留句柄和开头预览，模型真要再看时调用 read_output
+KEEP_TURNS = int(os.getenv("KEEP_TURNS", "4"))  # 最近几轮对话原样保留
+ELIDE_MIN_BYTES = 2048  # 只压缩超过这个长度的工具结果
+
+
+def elide_old_tool_results(messages: list, keep_recent: int = None) -> int:
+    """
+    原地把最近 KEEP_TURNS 轮之前的大工具结果替换为句柄和预览，返回压缩条数。
+
+    一轮从一条 user 消息开始。最近几轮不动，
+    模型的短期工作集和这部分请求前缀保持不变。
+    给出 keep_recent 时改为只保留最后 keep_recent 条消息（超出 token 预算时用）。
+    """
+    boundary = 0
+    if keep_recent is not None:
+        boundary = max(len(messages) - keep_recent, 0)
+    else:
+        turns = 0
+        for i in range(len(messages) - 1, -1, -1):
+            if messages[i]["role"] == "user":
+                turns += 1
+                if turns == KEEP_TURNS:
+                    boundary = i
+                    break
+    elided = 0
+    for i in range(boundary):
+        msg = messages[i]
+        content = msg.get("content")
+        if msg["role"] == "tool" and isinstance(content, str) and len(content) > ELIDE_MIN_BYTES:
+            handle = hashlib.blake2b(content.encode(errors="replace"), digest_size=8).hexdigest()
+            _store_output(handle, content)
+            messages[i] = {
+                **msg,
+                "content": f"<tool_output id={handle} len={len(content)}>\n{content[:512]}\n...</tool_output>",
+            }
+            elided += 1
+    return elided
+
+
+# 请求前估算 token 数：快到上下文上限时先压缩，而不是等服务端报错或截断。
+# 装了 tiktoken 就用它计数，否则按 UTF-8 字节数 / 4 粗略估计
+try:
+    import tiktoken
+    _ENCODING = tiktoken.get_encoding("cl100k_base")
+
+    def _count_tokens(text: str) -> int:
+        return len(_ENCODING.encode(text, disallowed_special=()))
+except ImportError:
+    def _count_tokens(text: str) -> int:
+        return len(text.encode(errors="replace")) // 4
+
+CONTEXT_TOKENS = int(os.getenv("CONTEXT_TOKENS", "128000"))
+TOKEN_BUDGET = int(CONTEXT_TOKENS * 0.8)
+BUDGET_KEEP_RECENT = 8  # 超预算时最后这几条消息保持原样
+
+# 消息只追加、被压缩时整条替换成新 dict，所以可以按对象缓存 token 数：
+# id(消息) -> (消息, token 数)。持有消息引用，id 不会被复用
+_token_cache: dict[int, tuple[dict, int]] = {}
+
+
+def _message_tokens(msg: dict) -> int:
+    entry = _token_cache.get(id(msg))
+    if entry and entry[0] is msg:
+        return entry[1]
+    text = msg.get("content") or ""
+    for tc in msg.get("tool_calls") or ():
+        text += tc["function"]["arguments"] or ""
+    n = _count_tokens(text) + 4  # 每条消息的角色等固定开销
+    _token_cache[id(msg)] = (msg, n)
+    return n
+
+
+def estimate_tokens(messages: list) -> int:
+    """估算 messages 的 token 数；只有新消息需要真正计数。"""
+    global _token_cache
+    total = sum(_message_tokens(m) for m in messages)
+    if len(_token_cache) > 2 * len(messages):
+        # 丢掉已被替换的旧消息，释放它们的引用
+        _token_cache = {id(m): _token_cache[id(m)] for m in messages}
+    return total
+
+
 # =============================================================================
 # 代理循环（带 todo 跟踪）
 # =============================================================================
@@ -480,71 +931,246 @@ def execute_tool(name: str, args: dict) -> str:
 # 跟踪自上次 todo 更新以来的轮数
 rounds_without_todo = 0
 
+# 同一轮的只读工具调用并发执行（都是 I/O 密集型，会释放 GIL）
+TOOL_CONCURRENCY_LIMIT = int(os.getenv("TOOL_CONCURRENCY_LIMIT", "8"))
+_TOOL_POOL = ThreadPoolExecutor(max_workers=TOOL_CONCURRENCY_LIMIT, thread_name_prefix="agent-tool")
+
+
+# 只读工具：同一条响应里参数完全相同的调用只执行一次，结果分给每个 tool_call_id
+_READ_ONLY_TOOLS = frozenset(("read_file", "read_output"))
+
+
+class _DeferredCall(Future):
+    """
+    推迟到取结果时才执行的工具调用。
+
+    bash、write_file、edit_file、TodoWrite 会改动工作区或全局状态，不能并发：
+    同一文件的两次 edit 会互相覆盖，write 之后的 bash 也可能先于写入运行。
+    agent_loop 按原始顺序取结果，在 result() 里执行，
+    就保证它们按调用顺序、在之前的调用都结束后逐个运行。
+    """
+
+    def __init__(self, name: str, args: dict):
+        super().__init__()
+        self._call = (name, args)
+
+    def result(self, timeout=None):
+        if not self.done():
+            try:
+                self.set_result(execute_tool(*self._call))
+            except Exception as e:
+                self.set_exception(e)
+        return super().result(timeout)
+
+
+def _new_turn() -> dict:
+    """一轮响应内的调度状态：已提交的只读调用，以及是否已经出现会改动状态的调用。"""
+    return {"reads": {}, "ordered": False}
+
+
+def _start_tool(name: str, arguments: str, turn: dict):
+    """
+    解析参数并开始执行工具，返回 (参数, future)。
+
+    只读工具提交到线程池并发执行，参数相同的调用复用已有的 future；
+    其他工具以及排在它后面的所有调用都推迟执行，按调用顺序逐个运行。
+    参数不是合法 JSON 时直接给出错误结果。
+    """
+    try:
+        args = _json_loads(arguments or "{}")
+    except ValueError as e:
+        future = Future()
+        future.set_result(f"错误: 参数无效: {e}")
+        return arguments, future
+    if turn["ordered"] or name not in _READ_ONLY_TOOLS:
+        turn["ordered"] = True
+        return args, _DeferredCall(name, args)
+    key = (name, _json_dumps_sorted(args))
+    reads = turn["reads"]
+    if key not in reads:
+        reads[key] = (args, _TOOL_POOL.submit(execute_tool, name, args))
+    return reads[key]
+
+
+# 终端上只显示参数摘要：write_file 的 content 可能有几十 KB，整段 repr 出来既慢又刷屏
+_ARG_PREVIEW = 80
+
+
+def _format_args(name: str, args) -> str:
+    """把工具参数格式化为一行简短摘要，长字符串值截断。"""
+    if not isinstance(args, dict):
+        return str(args)[:_ARG_PREVIEW]
+    if name == "TodoWrite" and isinstance(args.get("items"), list):
+        return f"{len(args['items'])} 项"
+    return str({
+        k: v[:_ARG_PREVIEW] + "…" if isinstance(v, str) and len(v) > _ARG_PREVIEW else v
+        for k, v in args.items()
+    })
+
+
+# 终端输出先攒在内存里，攒够一批再一次性写出：
+# 每次 write 都是一次系统调用（Windows 控制台上更贵），流式输出时逐 token 写很浪费
+_OUT_BUF = []
+_OUT_FLUSH_EVERY = 16  # 流式文本每攒这么多段刷新一次
+
+
+def _emit(text: str):
+    """把文本放进输出缓冲，攒够一批时刷新。"""
+    _OUT_BUF.append(text)
+    if len(_OUT_BUF) >= _OUT_FLUSH_EVERY:
+        _flush_out()
+
+
+def _flush_out():
+    """把缓冲的输出合并成一次写入。"""
+    if _OUT_BUF:
+        sys.stdout.write("".join(_OUT_BUF))
+        _OUT_BUF.clear()
+    sys.stdout.flush()
+
+
+def stream_turn(messages: list):
+    """
+    流式调用模型一次。
+
+    文本边生成边打印；只读工具调用的 arguments 一拼成完整 JSON 就立即开始执行，
+    不必等整条响应生成完，工具执行和模型生成因此重叠。
+    前面的调用都已开始后才会提前开始下一个，调度顺序始终和调用顺序一致。
+    启用缓存且命中时直接重放缓存的助手消息。
+
+    返回 (assistant_msg, calls)，calls 按原始顺序排列，元素为 (id, 名称, 参数, future)。
+    """
+    key = None
+    if TEMPERATURE == 0 or LLM_CACHE_FORCE:
+        key = _cache_key(messages, TEMPERATURE)
+        cached = cache_get(key)
+        if cached:
+            turn = _new_turn()
+            if cached["content"]:
+                _emit(cached["content"] + "\n")
+            calls = [
+                (tc["id"], tc["function"]["name"], *_start_tool(tc["function"]["name"], tc["function"]["arguments"], turn))
+                for tc in cached.get("tool_calls", ())
+            ]
+            return cached, calls
+
+    stream = client.chat.completions.create(
+        model=MODEL,
+        messages=messages,
+        tools=TOOLS,
+        temperature=TEMPERATURE,
+        stream=True,
+    )
+    text = []
+    slots = {}  # index -> {"id", "name", "arguments", "call"}
+    turn = _new_turn()
+    for chunk in stream:
+        if not chunk.choices:
+            continue
+        delta = chunk.choices[0].delta
+        if delta.content:
+            _emit(delta.content)
+            text.append(delta.content)
+        if delta.tool_calls and _OUT_BUF:
+            _flush_out()  # 文本说完了，接下来是工具参数：先把已缓冲的文本显示出来
+        for tc in delta.tool_calls or ():
+            slot = slots.setdefault(tc.index, {"id": "", "name": "", "arguments": "", "call": None})
+            if tc.id:
+                slot["id"] = tc.id
+            if tc.function:
+                slot["name"] += tc.function.name or ""
+                slot["arguments"] += tc.function.arguments or ""
+            # JSON 对象只有在结尾的 } 到达后才能解析成功，所以解析成功即参数完整
+            if slot["call"] is None and slot["name"] and slot["arguments"].rstrip().endswith("}"):
+                if any(s["call"] is None for i, s in slots.items() if i < tc.index):
+                    continue
+                try:
+                    _json_loads(slot["arguments"])
+                except ValueError:
+                    continue
+                slot["call"] = _start_tool(slot["name"], slot["arguments"], turn)
+    if text:
+        _emit("\n")
+
+    calls = []
+    for index in sorted(slots):
+        slot = slots[index]
+        if slot["call"] is None:
+            slot["call"] = _start_tool(slot["name"], slot["arguments"], turn)
+        calls.append((slot["id"], slot["name"], *slot["call"]))
+
+    assistant_msg = {"role": "assistant", "content": "".join(text)}
+    if calls:
+        assistant_msg["tool_calls"] = [
+            {
+                "id": slots[index]["id"],
+                "type": "function",
+                "function": {
+                    "name": slots[index]["name"],
+                    "arguments": slots[index]["arguments"]
+                }
+            }
+            for index in sorted(slots)
+        ]
+    if key:
+        cache_put(key, assistant_msg)
+    return assistant_msg, calls
+
 
 def agent_loop(messages: list) -> list:
     """
     带 todo 使用跟踪的代理循环。
 
     与 v1 相同的核心循环，但现在我们跟踪模型是否使用 todos。
-    如果太久没有更新，我们在下一条用户消息中注入提醒。
+    如果太久没有更新，我们在下一次请求末尾临时附上提醒。
     """
     global rounds_without_todo
 
+    # system 消息只在历史开头放一次，之后只追加，
+    # 每次请求的前缀逐字节不变，服务端的前缀缓存才能命中
+    if not messages or messages[0].get("role") != "system":
+        messages.insert(0, _SYSTEM_MSG)
+
     while True:
-        # 步骤 1: 调用模型
-        response = client.chat.completions.create(
-            model=MODEL,
-            messages=[{"role": "system", "content": SYSTEM}] + messages,
-            tools=TOOLS,
-            temperature=0.7
-        )
+        # 快到上下文上限时，先把最近几条之外的大工具输出换成句柄
+        if estimate_tokens(messages) > TOKEN_BUDGET:
+            elide_old_tool_results(messages, keep_recent=BUDGET_KEEP_RECENT)
 
-        msg = response.choices[0].message
+        # 步骤 1: 流式调用模型（工具在生成过程中就开始执行）
+        # 超过 10 轮没用 todos 时，只在这次请求末尾临时加一条 system 提醒：
+        # 历史不变，已缓存的前缀不受影响，提醒也不会永久留在上下文里
+        request = messages + [_NAG_MSG] if rounds_without_todo > 10 else messages
+        assistant_msg, calls = stream_turn(request)
 
         # 步骤 2: 保存助手消息
-        assistant_msg = {"role": "assistant", "content": msg.content or ""}
-        if msg.tool_calls:
-            assistant_msg["tool_calls"] = [
-                {
-                    "id": tc.id,
-                    "type": tc.type,
-                    "function": {
-                        "name": tc.function.name,
-                        "arguments": tc.function.arguments
-                    }
-                }
-                for tc in msg.tool_calls
-            ]
         messages.append(assistant_msg)
 
-        # 打印文本输出
-        if msg.content:
-            print(msg.content)
-
         # 步骤 3: 如果没有工具调用，任务完成
-        if not msg.tool_calls:
+        if not calls:
+            _flush_out()
             return messages
 
-        # 步骤 4: 执行每个工具并收集结果
+        # 步骤 4: 按原始顺序收集结果（推迟的调用在这里依次执行）；单个工具失败不影响同批其他工具
         results = []
         used_todo = False
 
-        for tool_call in msg.tool_calls:
-            func_name = tool_call.function.name
-            func_args = json.loads(tool_call.function.arguments)
-
-            # 显示正在执行的内容
-            print(f"\n> {func_name}: {func_args}")
+        for call_id, func_name, func_args, future in calls:
+            # 显示正在执行的内容；工具还没跑完就先刷新，等待期间也能看到
+            _emit(f"\n> {func_name}: {_format_args(func_name, func_args)}\n")
+            if not future.done():
+                _flush_out()
 
-            # 执行并显示结果预览
-            output = execute_tool(func_name, func_args)
+            try:
+                output = future.result()
+            except Exception as e:
+                output = f"错误: {e}"
             preview = output[:200] + "..." if len(output) > 200 else output
-            print(f"  {preview}")
+            _emit(f"  {preview}\n")
 
             # 为模型收集结果
             results.append({
                 "role": "tool",
-                "tool_call_id": tool_call.id,
+                "tool_call_id": call_id,
                 "content": output
             })
 
@@ -558,15 +1184,11 @@ def agent_loop(messages: list) -> list:
         else:
             rounds_without_todo += 1
 
-        # 如果模型超过 10 轮没有使用 todos，注入 NAG_REMINDER
-        # 这发生在 agent_loop 内部，所以模型在任务执行期间看到它
-        if rounds_without_todo > 10:
-            messages.append({"role": "user", "content": NAG_REMINDER})
-
         # 分别添加每个工具结果到消息历史
         # GLM API 不支持 content 作为列表
         for result in results:
             messages.append(result)
+        _flush_out()
 
 
 # =============================================================================
@@ -588,14 +1210,19 @@ def main():
     print(f"Mini Claude Code v2 (带 Todos) - {WORKDIR}")
     print("输入 'exit' 退出。\n")
 
-    history = []
+    history = [_SYSTEM_MSG]
     first_message = True
 
     while True:
+        # input() 会阻塞主线程：把历史压缩交给工具池，和用户打字的时间重叠。
+        # 读到输入后等压缩完成，再交给 agent_loop
+        idle = _TOOL_POOL.submit(elide_old_tool_results, history)
         try:
             user_input = input("You: ").strip()
         except (EOFError, KeyboardInterrupt):
             break
+        finally:
+            idle.result()
 
         if not user_input or user_input.lower() in ("exit", "quit", "q"):
             break
@@ -624,10 +1251,14 @@ def main():
             # 运行代理循环
             agent_loop(history)
         except Exception as e:
+            _flush_out()
             print(f"错误: {e}")
 
         print()  # 轮次之间的空行
 
+    if cache_stats["hits"] or cache_stats["misses"]:
+        print(f"LLM 缓存: {cache_stats['hits']} 命中, {cache_stats['misses']} 未命中")
+
 
 if __name__ == "__main__":
     main()
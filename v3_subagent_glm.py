@@ -76,11 +76,18 @@ v2 添加了规划。但对于像"探索代码库然后重构认证"这样的大
     python v3_subagent_glm.py
 """
 
+import importlib.util
 import os
 import sys
 import json
+import mmap
+import re
 import subprocess
+import threading
 import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import lru_cache
+from itertools import islice
 from pathlib import Path
 
 # 修复 locale 编码问题（macOS/Linux）
@@ -90,9 +97,17 @@ if sys.platform != "win32":
         os.environ["LANG"] = "en_US.UTF-8"
         os.environ["LC_ALL"] = "en_US.UTF-8"
 
-from openai import OpenAI
+import httpx
+from openai import DefaultHttpxClient, OpenAI
 from dotenv import load_dotenv
 
+# 工具参数解析：装了 orjson 就用它（比标准库快数倍），否则退回 json
+try:
+    import orjson
+    _json_loads = orjson.loads
+except ImportError:
+    _json_loads = json.loads
+
 load_dotenv(override=True)
 
 
@@ -101,11 +116,23 @@ load_dotenv(override=True)
 # =============================================================================
 
 WORKDIR = Path.cwd()
+# 复用连接池：主代理和并发的子代理共用 keep-alive 连接，装了 h2 时启用 HTTP/2 多路复用；
+# 建连失败时由 transport 重试两次（请求级别的重试仍由 SDK 负责）
 client = OpenAI(
     api_key=os.getenv("ZHIPU_API_KEY", "your_api_key_here"),
-    base_url=os.getenv("ZHIPU_BASE_URL", "https://open.bigmodel.cn/api/paas/v4")
+    base_url=os.getenv("ZHIPU_BASE_URL", "https://open.bigmodel.cn/api/paas/v4"),
+    http_client=DefaultHttpxClient(
+        transport=httpx.HTTPTransport(
+            http2=importlib.util.find_spec("h2") is not None,
+            limits=httpx.Limits(max_keepalive_connections=32, max_connections=64, keepalive_expiry=60.0),
+            retries=2,
+        ),
+        timeout=httpx.Timeout(120.0, connect=10.0),
+    ),
 )
 MODEL = os.getenv("MODEL_ID", "glm-4.7")
+# MCC_VERBOSE=0 时不打印每个工具的参数和输出预览（批量/CI 运行时省掉这部分终端开销）
+VERBOSE = os.getenv("MCC_VERBOSE", "1") != "0"
 
 
 # =============================================================================
@@ -156,6 +183,7 @@ class TodoManager:
 
     def __init__(self):
         self.items = []
+        self._lock = threading.Lock()  # 并行的子代理可能同时更新
 
     def update(self, items: list) -> str:
         validated = []
@@ -182,19 +210,21 @@ class TodoManager:
         if in_progress > 1:
             raise ValueError("一次只能有一个任务处于 in_progress 状态")
 
-        self.items = validated[:20]
-        return self.render()
+        with self._lock:
+            self.items = validated[:20]
+            return self.render()
 
     def render(self) -> str:
-        if not self.items:
+        items = self.items
+        if not items:
             return "没有任务。"
         lines = []
-        for t in self.items:
+        for t in items:
             mark = "[x]" if t["status"] == "completed" else \
                    "[>]" if t["status"] == "in_progress" else "[ ]"
             lines.append(f"{mark} {t['content']}")
-        done = sum(1 for t in self.items if t["status"] == "completed")
-        return "\n".join(lines) + f"\n({done}/{len(self.items)} 已完成)"
+        done = sum(1 for t in items if t["status"] == "completed")
+        return "\n".join(lines) + f"\n({done}/{len(items)} 已完成)"
 
 
 TODO = TodoManager()
@@ -358,53 +388,79 @@ TASK_TOOL = {
 # 主代理获得所有工具包括 Task
 ALL_TOOLS = BASE_TOOLS + [TASK_TOOL]
 
+# AGENT_TYPES 是静态的，每种代理的工具列表在导入时算好，创建子代理时直接查表。
+# '*' 表示所有基础工具（但不包括 Task，防止无限递归）
+_TOOLS_BY_AGENT = {
+    name: BASE_TOOLS if cfg["tools"] == "*"
+    else [t for t in BASE_TOOLS if t["function"]["name"] in cfg["tools"]]
+    for name, cfg in AGENT_TYPES.items()
+}
+
 
 def get_tools_for_agent(agent_type: str) -> list:
     """
-    根据代理类型过滤工具。
+    根据代理类型过滤工具（查导入时算好的 _TOOLS_BY_AGENT）。
 
     每个代理类型都有一个允许的工具白名单。
     '*' 表示所有工具（但子代理不获取 Task 以防止无限递归）。
     """
-    allowed = AGENT_TYPES.get(agent_type, {}).get("tools", "*")
-
-    if allowed == "*":
-        return BASE_TOOLS  # 所有基础工具，但不包括 Task（演示中没有递归）
-
-    return [t for t in BASE_TOOLS if t["name"] in allowed]
+    return _TOOLS_BY_AGENT.get(agent_type, BASE_TOOLS)
 
 
 # =============================================================================
 # 工具实现
 # =============================================================================
 
-def safe_path(p: str) -> Path:
+# 工作区根目录只解析一次；结尾带分隔符，前缀比较时 /work 不会误匹配 /work2
+_WORKDIR_RESOLVED = str(WORKDIR.resolve())
+_WORKDIR_PREFIX = os.path.join(_WORKDIR_RESOLVED, "")
+
+
+def _check_path(p: str) -> Path:
     """确保路径保持在工作区内（安全措施）。"""
     path = (WORKDIR / p).resolve()
-    if not path.is_relative_to(WORKDIR):
+    resolved = str(path)
+    if resolved != _WORKDIR_RESOLVED and not resolved.startswith(_WORKDIR_PREFIX):
         raise ValueError(f"路径逃逸工作区: {p}")
     return path
 
 
+@lru_cache(maxsize=4096)
+def safe_path(p: str) -> Path:
+    """
+    带缓存的 _check_path，供读文件使用。
+
+    resolve() 要逐级 stat/readlink，模型又会反复读同一批文件，所以按原始字符串缓存
+    （越界的路径抛异常，不会被缓存）。写文件仍走 _check_path 现场解析，
+    这样之后才出现的符号链接也会被检查到。
+    """
+    return _check_path(p)
+
+
+# Windows 命令转换（模型习惯用 Unix 命令）：一个正则匹配命令开头，再查表替换
+_WIN_CMD_MAP = {
+    "ls": "dir",
+    "cat": "type",
+    "grep": "findstr",
+    "rm": "del",
+    "mv": "move",
+    "cp": "copy",
+    "pwd": "cd",
+}
+_WIN_CMD_RE = re.compile(r"^\s*(ls|cat|grep|rm|mv|cp|pwd)(?=\s|$)")
+
+# 危险命令黑名单编译成一个正则：每次调用只扫描一遍命令
+DANGEROUS = ["rm -rf /", "sudo", "shutdown", "reboot"]
+_DANGEROUS_RE = re.compile("|".join(map(re.escape, DANGEROUS)))
+
+
 def run_bash(cmd: str) -> str:
     """执行 shell 命令并进行安全检查。"""
-    # Windows 命令转换
     if sys.platform == "win32":
-        cmd_map = {
-            "ls": "dir",
-            "cat": "type",
-            "grep": "findstr",
-            "rm": "del",
-            "mv": "move",
-            "cp": "copy",
-            "pwd": "cd",
-        }
-        for unix_cmd, win_cmd in cmd_map.items():
-            if cmd.strip().startswith(unix_cmd + " ") or cmd.strip() == unix_cmd:
-                cmd = cmd.replace(unix_cmd, win_cmd, 1)
-                break
+        # 只替换命令开头的 Unix 命令
+        cmd = _WIN_CMD_RE.sub(lambda m: _WIN_CMD_MAP[m.group(1)], cmd, count=1)
 
-    if any(d in cmd for d in ["rm -rf /", "sudo", "shutdown", "reboot"]):
+    if _DANGEROUS_RE.search(cmd):
         return "错误: 危险命令被阻止"
     try:
         r = subprocess.run(
@@ -419,10 +475,13 @@ def run_bash(cmd: str) -> str:
 def run_read(path: str, limit: int = None) -> str:
     """读取文件内容。"""
     try:
-        lines = safe_path(path).read_text().splitlines()
-        if limit:
-            lines = lines[:limit]
-        return "\n".join(lines)[:50000]
+        with safe_path(path).open() as f:
+            if limit:
+                # 只读前 limit 行，不把整个文件读进内存
+                return "\n".join(line.rstrip("\r\n") for line in islice(f, limit))[:50000]
+            # 反正要截断到 50000 字符，多读一个字符就够判断是否超长
+            text = f.read(50001)
+        return text[:50000] if len(text) > 50000 else text.removesuffix("\n")
     except Exception as e:
         return f"错误: {e}"
 
@@ -430,7 +489,7 @@ def run_read(path: str, limit: int = None) -> str:
 def run_write(path: str, content: str) -> str:
     """将内容写入文件。"""
     try:
-        fp = safe_path(path)
+        fp = _check_path(path)
         fp.parent.mkdir(parents=True, exist_ok=True)
         fp.write_text(content)
         return f"写入 {len(content)} 字节到 {path}"
@@ -441,12 +500,32 @@ def run_write(path: str, content: str) -> str:
 def run_edit(path: str, old_text: str, new_text: str) -> str:
     """替换文件中的精确文本。"""
     try:
-        fp = safe_path(path)
-        text = fp.read_text()
-        if old_text not in text:
-            return f"错误: 在 {path} 中未找到文本"
-        fp.write_text(text.replace(old_text, new_text, 1))
-        return f"已编辑 {path}"
+        fp = _check_path(path)
+        old = old_text.encode()
+        with open(fp, "r+b") as f:
+            # 用 mmap 在字节上查找，不把整个文件解码成 str 再复制一份
+            if os.fstat(f.fileno()).st_size:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    idx = mm.find(old)
+                    tail = mm[idx + len(old):] if idx >= 0 else None
+                    has_cr = idx < 0 and mm.find(b"\r") >= 0
+            else:
+                idx, tail, has_cr = (-1 if old else 0), b"", False
+            if idx >= 0:
+                # 匹配位置之前的内容不动，只从匹配处重写到文件末尾
+                f.seek(idx)
+                f.write(new_text.encode() + tail)
+                f.truncate()
+                return f"已编辑 {path}"
+
+        # CRLF 文件：按文本模式读取时换行已统一为 \n，退回按文本查找
+        if has_cr:
+            text = fp.read_text()
+            idx = text.find(old_text)
+            if idx >= 0:
+                fp.write_text(text[:idx] + new_text + text[idx + len(old_text):])
+                return f"已编辑 {path}"
+        return f"错误: 在 {path} 中未找到文本"
     except Exception as e:
         return f"错误: {e}"
 
@@ -463,7 +542,11 @@ def run_todo(items: list) -> str:
 # 子代理执行 - v3 的核心
 # =============================================================================
 
-def run_task(description: str, prompt: str, agent_type: str) -> str:
+_PROGRESS_INTERVAL = 0.033  # 进度行最多每秒刷新约 30 次，避免频繁 flush 拖慢终端（尤其是 SSH）
+_CLEAR_LINE = "\x1b[2K\r"  # 先清掉整行再回到行首，不会残留上一次更长的进度文字
+
+
+def run_task(description: str, prompt: str, agent_type: str, live: bool = True) -> str:
     """
     执行带有隔离上下文的子代理任务。
 
@@ -483,6 +566,7 @@ def run_task(description: str, prompt: str, agent_type: str) -> str:
       [explore] 查找认证文件 ... 5 个工具，3.2秒
 
     这提供了可见性，而不会污染主对话。
+    多个子代理并行时传 live=False，只打印开始和完成两行，避免 \r 进度行互相覆盖。
     """
     if agent_type not in AGENT_TYPES:
         return f"错误: 未知的代理类型 '{agent_type}'"
@@ -505,74 +589,50 @@ def run_task(description: str, prompt: str, agent_type: str) -> str:
 
     # 进度跟踪
     print(f"  [{agent_type}] {description}")
-    start = time.time()
+    start = time.monotonic()
     tool_count = 0
+    last_progress = 0.0
 
     # 运行相同的代理循环（静默 - 不打印到主聊天）
     while True:
-        response = client.chat.completions.create(
-            model=MODEL,
-            messages=[{"role": "system", "content": sub_system}] + sub_messages,
-            tools=sub_tools,
-            temperature=0.7
+        assistant_msg, calls = stream_turn(
+            [{"role": "system", "content": sub_system}] + sub_messages, sub_tools, echo=False
         )
 
-        msg = response.choices[0].message
-
-        if not msg.tool_calls:
+        if not calls:
             break
 
         # 保存助手消息
-        sub_messages.append({
-            "role": "assistant",
-            "content": msg.content or "",
-            "tool_calls": [
-                {
-                    "id": tc.id,
-                    "type": tc.type,
-                    "function": {
-                        "name": tc.function.name,
-                        "arguments": tc.function.arguments
-                    }
-                }
-                for tc in msg.tool_calls
-            ]
-        })
-
-        results = []
+        sub_messages.append(assistant_msg)
 
-        for tc in msg.tool_calls:
+        # 工具在流式生成时就已开始执行，这里按原顺序收集结果
+        for call_id, _, _, future in calls:
             tool_count += 1
-            func_name = tc.function.name
-            func_args = json.loads(tc.function.arguments)
-            output = execute_tool(func_name, func_args)
-            results.append({
+            sub_messages.append({
                 "role": "tool",
-                "tool_call_id": tc.id,
-                "content": output
+                "tool_call_id": call_id,
+                "content": _tool_output(future)
             })
 
-            # 更新进度行（就地）
-            elapsed = time.time() - start
-            sys.stdout.write(
-                f"\r  [{agent_type}] {description} ... {tool_count} 工具, {elapsed:.1f}秒"
-            )
-            sys.stdout.flush()
-
-        sub_messages.append({"role": "user", "content": results})
+            # 更新进度行（就地，限频；完成行总会输出）
+            elapsed = time.monotonic() - start
+            if live and elapsed - last_progress >= _PROGRESS_INTERVAL:
+                last_progress = elapsed
+                sys.stdout.write(
+                    f"{_CLEAR_LINE}  [{agent_type}] {description} ... {tool_count} 工具, {elapsed:.1f}秒"
+                )
+                sys.stdout.flush()
 
     # 最终进度更新
-    elapsed = time.time() - start
+    elapsed = time.monotonic() - start
+    prefix = _CLEAR_LINE if live else ""
     sys.stdout.write(
-        f"\r  [{agent_type}] {description} - 完成 ({tool_count} 工具, {elapsed:.1f}秒)\n"
+        f"{prefix}  [{agent_type}] {description} - 完成 ({tool_count} 工具, {elapsed:.1f}秒)\n"
     )
 
     # 提取并只返回最终文本
     # 这是父代理看到的 - 干净的摘要
-    if msg.content:
-        return msg.content
-
-    return "(子代理没有返回文本)"
+    return assistant_msg["content"] or "(子代理没有返回文本)"
 
 
 def execute_tool(name: str, args: dict) -> str:
@@ -592,6 +652,174 @@ def execute_tool(name: str, args: dict) -> str:
     return f"未知工具: {name}"
 
 
+# 同一轮的只读调用和子代理都是 I/O 密集型（文件、子代理的 LLM 调用），
+# 线程并发执行时耗时取最长的一个而不是总和
+TOOL_CONCURRENCY_LIMIT = int(os.getenv("TOOL_CONCURRENCY_LIMIT", "8"))
+_TOOL_POOL = ThreadPoolExecutor(max_workers=TOOL_CONCURRENCY_LIMIT, thread_name_prefix="agent-tool")
+# 子代理单独一个池：它们会等待自己的工具，和普通工具共用一个池可能互相占满而卡死。
+# 子代理的耗时几乎全在等模型响应，并发数主要受服务端限流约束，可按需调大
+TASK_CONCURRENCY_LIMIT = int(os.getenv("TASK_CONCURRENCY_LIMIT", "4"))
+_TASK_POOL = ThreadPoolExecutor(max_workers=TASK_CONCURRENCY_LIMIT, thread_name_prefix="subagent")
+
+
+# 只读工具可以并发；bash、write_file、edit_file、TodoWrite 会改动工作区或全局状态
+_READ_ONLY_TOOLS = frozenset(("read_file",))
+# 每个代理内部按调用顺序执行改动类工具，但并行的子代理之间仍可能同时改同一个文件：
+# 这类工具在整个进程内一次只执行一个
+_MUTATION_LOCK = threading.Lock()
+
+
+def _run_call(name: str, args: dict, live: bool = True) -> str:
+    """执行一个工具调用：Task 交给 run_task（live 传给它），改动类工具持有 _MUTATION_LOCK。"""
+    if name == "Task":
+        return run_task(args["description"], args["prompt"], args["agent_type"], live=live)
+    if name in _READ_ONLY_TOOLS:
+        return execute_tool(name, args)
+    with _MUTATION_LOCK:
+        return execute_tool(name, args)
+
+
+class _DeferredCall(Future):
+    """
+    推迟到取结果时才执行的工具调用。
+
+    改动类工具不能并发：同一文件的两次 edit 会互相覆盖，write 之后的 bash 也可能先于写入运行。
+    agent_loop 和 run_task 都按原始顺序取结果，在 result() 里执行，
+    就保证它们按调用顺序、在之前的调用都结束后逐个运行。
+    """
+
+    def __init__(self, name: str, args: dict, live: bool = True):
+        super().__init__()
+        self._call = (name, args, live)
+
+    def result(self, timeout=None):
+        if not self.done():
+            try:
+                self.set_result(_run_call(*self._call))
+            except Exception as e:
+                self.set_exception(e)
+        return super().result(timeout)
+
+
+def _new_turn() -> dict:
+    """一轮响应内的调度状态：是否已经出现改动类调用。"""
+    return {"ordered": False}
+
+
+def _submit_tool(name: str, args: dict, turn: dict, live: bool = True) -> Future:
+    """
+    开始执行一个工具，返回 future。
+
+    只读工具提交到工具池，Task 提交到子代理池，二者并发执行；
+    改动类工具以及排在它后面的所有调用都推迟，按调用顺序逐个执行。
+    """
+    if turn["ordered"] or (name not in _READ_ONLY_TOOLS and name != "Task"):
+        turn["ordered"] = True
+        return _DeferredCall(name, args, live)
+    if name == "Task":
+        return _TASK_POOL.submit(_run_call, name, args, live)
+    return _TOOL_POOL.submit(execute_tool, name, args)
+
+
+def _tool_output(future: Future) -> str:
+    """取出工具结果；单个工具失败不影响同批其他工具。"""
+    try:
+        return future.result()
+    except Exception as e:
+        return f"错误: {e}"
+
+
+def _start_tool(name: str, arguments: str, turn: dict, live: bool = True):
+    """解析参数并开始执行工具，返回 (参数, future)。参数不是合法 JSON 时直接给出错误结果。"""
+    try:
+        args = _json_loads(arguments or "{}")
+    except ValueError as e:
+        future = Future()
+        future.set_result(f"错误: 参数无效: {e}")
+        return arguments, future
+    return args, _submit_tool(name, args, turn, live)
+
+
+def stream_turn(messages: list, tools: list, echo: bool = True):
+    """
+    流式调用模型一次。
+
+    文本边生成边打印（echo=False 时不打印）；只读工具的 arguments 一拼成完整 JSON
+    就立即开始执行，不必等整条响应生成完，工具执行和模型生成因此重叠。
+    前面的调用都已开始后才会提前开始下一个，调度顺序始终和调用顺序一致。
+    Task 等响应结束后再启动：那时才知道同一轮有几个 Task，多个时关掉 \r 进度行。
+
+    返回 (assistant_msg, calls)，calls 按原始顺序排列，元素为 (id, 名称, 参数, future)。
+    """
+    stream = client.chat.completions.create(
+        model=MODEL,
+        messages=messages,
+        tools=tools,
+        temperature=0.7,
+        stream=True,
+    )
+    text = []
+    slots = {}  # index -> {"id", "name", "arguments", "call"}
+    turn = _new_turn()
+    for chunk in stream:
+        if not chunk.choices:
+            continue
+        delta = chunk.choices[0].delta
+        if delta.content:
+            if echo:
+                print(delta.content, end="", flush=True)
+            text.append(delta.content)
+        for tc in delta.tool_calls or ():
+            slot = slots.setdefault(tc.index, {"id": "", "name": "", "arguments": "", "call": None})
+            if tc.id:
+                slot["id"] = tc.id
+            if tc.function:
+                slot["name"] += tc.function.name or ""
+                slot["arguments"] += tc.function.arguments or ""
+            # JSON 对象只有在结尾的 } 到达后才能解析成功，所以解析成功即参数完整
+            if (slot["call"] is None and slot["name"] and slot["name"] != "Task"
+                    and slot["arguments"].rstrip().endswith("}")):
+                if any(s["call"] is None for i, s in slots.items() if i < tc.index):
+                    continue
+                try:
+                    _json_loads(slot["arguments"])
+                except ValueError:
+                    continue
+                slot["call"] = _start_tool(slot["name"], slot["arguments"], turn)
+    if text and echo:
+        print()
+
+    ordered = [slots[index] for index in sorted(slots)]
+    live = sum(slot["name"] == "Task" for slot in ordered) <= 1
+    calls = []
+    for slot in ordered:
+        if slot["call"] is None:
+            if slot["name"] == "Task" and echo:
+                # 子代理运行时会输出自己的进度行，标题要在它启动前打印
+                try:
+                    description = _json_loads(slot["arguments"]).get("description", "子任务")
+                except (ValueError, AttributeError):
+                    description = "子任务"
+                print(f"\n> Task: {description}")
+            slot["call"] = _start_tool(slot["name"], slot["arguments"], turn, live)
+        calls.append((slot["id"], slot["name"], *slot["call"]))
+
+    assistant_msg = {"role": "assistant", "content": "".join(text)}
+    if calls:
+        assistant_msg["tool_calls"] = [
+            {
+                "id": slot["id"],
+                "type": "function",
+                "function": {
+                    "name": slot["name"],
+                    "arguments": slot["arguments"]
+                }
+            }
+            for slot in ordered
+        ]
+    return assistant_msg, calls
+
+
 # =============================================================================
 # 主代理循环
 # =============================================================================
@@ -601,64 +829,34 @@ def agent_loop(messages: list) -> list:
     支持子代理的主代理循环。
 
     与 v1/v2 相同的模式，但现在包括 Task 工具。
-    当模型调用 Task 时，它生成一个带有隔离上下文的子代理。
+    当模型调用 Task 时，它生成一个带有隔离上下文的子代理；
+    同一轮的只读调用和多个 Task 并行执行，改动类工具按调用顺序逐个执行。
     """
     while True:
-        response = client.chat.completions.create(
-            model=MODEL,
-            messages=[{"role": "system", "content": SYSTEM}] + messages,
-            tools=ALL_TOOLS,
-            temperature=0.7
+        # 流式调用模型（文本边生成边打印，工具在生成过程中就开始执行）
+        assistant_msg, calls = stream_turn(
+            [{"role": "system", "content": SYSTEM}] + messages, ALL_TOOLS
         )
-
-        msg = response.choices[0].message
-
-        # 保存助手消息
-        assistant_msg = {"role": "assistant", "content": msg.content or ""}
-        if msg.tool_calls:
-            assistant_msg["tool_calls"] = [
-                {
-                    "id": tc.id,
-                    "type": tc.type,
-                    "function": {
-                        "name": tc.function.name,
-                        "arguments": tc.function.arguments
-                    }
-                }
-                for tc in msg.tool_calls
-            ]
         messages.append(assistant_msg)
 
-        # 打印文本输出
-        if msg.content:
-            print(msg.content)
-
         # 如果没有工具调用，任务完成
-        if not msg.tool_calls:
+        if not calls:
             return messages
 
-        # 执行每个工具并收集结果
+        # 按原顺序收集结果
         results = []
-        for tc in msg.tool_calls:
-            func_name = tc.function.name
-            func_args = json.loads(tc.function.arguments)
-
-            # Task 工具有特殊的显示处理
-            if func_name == "Task":
-                print(f"\n> Task: {func_args.get('description', '子任务')}")
-            else:
-                print(f"\n> {func_name}: {func_args}")
-
-            output = execute_tool(func_name, func_args)
+        for call_id, func_name, func_args, future in calls:
+            output = _tool_output(future)
 
             # 不打印完整的 Task 输出（它管理自己的显示）
-            if func_name != "Task":
+            if func_name != "Task" and VERBOSE:
+                print(f"\n> {func_name}: {func_args}")
                 preview = output[:200] + "..." if len(output) > 200 else output
                 print(f"  {preview}")
 
             results.append({
                 "role": "tool",
-                "tool_call_id": tc.id,
+                "tool_call_id": call_id,
                 "content": output
             })
 
@@ -99,6 +99,8 @@ SKILLS_DIR = WORKDIR / "skills"
 
 client = Anthropic(base_url=os.getenv("ANTHROPIC_BASE_URL"))
 MODEL = os.getenv("MODEL_ID", "claude-sonnet-4-5-20250929")
+# MCC_VERBOSE=0 skips the per-tool output preview (batch/CI runs)
+VERBOSE = os.getenv("MCC_VERBOSE", "1") != "0"
 
 
 # =============================================================================
@@ -361,6 +363,10 @@ Rules:
 - Prefer tools over prose. Act, don't just explain.
 - After finishing, summarize what changed."""
 
+# System prompt as a content block carrying a cache breakpoint: the tools and
+# system prefix are cached once and read back on every later request.
+SYSTEM_BLOCKS = [{"type": "text", "text": SYSTEM, "cache_control": {"type": "ephemeral"}}]
+
 
 # =============================================================================
 # Tool Definitions
@@ -600,6 +606,10 @@ def run_skill(skill_name: str) -> str:
 Follow the instructions in the skill above to complete the user's task."""
 
 
+_PROGRESS_INTERVAL = 0.033  # Redraw the progress line at most ~30x/s; each flush is a TTY write
+_CLEAR_LINE = "\x1b[2K\r"  # Erase the whole line, then return to column 0
+
+
 def run_task(description: str, prompt: str, agent_type: str) -> str:
     """Execute a subagent task (from v3). See v3 for details."""
     if agent_type not in AGENT_TYPES:
@@ -616,10 +626,12 @@ Complete the task and return a clear, concise summary."""
     sub_messages = [{"role": "user", "content": prompt}]
 
     print(f"  [{agent_type}] {description}")
-    start = time.time()
+    start = time.monotonic()
     tool_count = 0
+    last_progress = 0.0
 
     while True:
+        mark_cache_breakpoints(sub_messages)
         response = client.messages.create(
             model=MODEL,
             system=sub_system,
@@ -643,18 +655,21 @@ Complete the task and return a clear, concise summary."""
                 "content": output
             })
 
-            elapsed = time.time() - start
-            sys.stdout.write(
-                f"\r  [{agent_type}] {description} ... {tool_count} tools, {elapsed:.1f}s"
-            )
-            sys.stdout.flush()
+            # Throttled; the final "done" line is always written
+            elapsed = time.monotonic() - start
+            if elapsed - last_progress >= _PROGRESS_INTERVAL:
+                last_progress = elapsed
+                sys.stdout.write(
+                    f"{_CLEAR_LINE}  [{agent_type}] {description} ... {tool_count} tools, {elapsed:.1f}s"
+                )
+                sys.stdout.flush()
 
         sub_messages.append({"role": "assistant", "content": response.content})
         sub_messages.append({"role": "user", "content": results})
 
-    elapsed = time.time() - start
+    elapsed = time.monotonic() - start
     sys.stdout.write(
-        f"\r  [{agent_type}] {description} - done ({tool_count} tools, {elapsed:.1f}s)\n"
+        f"{_CLEAR_LINE}  [{agent_type}] {description} - done ({tool_count} tools, {elapsed:.1f}s)\n"
     )
 
     for block in response.content:
@@ -683,6 +698,53 @@ def execute_tool(name: str, args: dict) -> str:
     return f"Unknown tool: {name}"
 
 
+# =============================================================================
+# Prompt Cache Breakpoints
+# =============================================================================
+
+# The API allows 4 cache breakpoints per request; the system prompt uses one.
+# The rest go on the newest user block (so the next turn reads everything
+# before it from cache) and on the most recent large results (loaded skills,
+# big file reads), so those stay cached even when the newest breakpoint misses.
+MAX_MESSAGE_BREAKPOINTS = 3
+CACHE_PIN_CHARS = 4096
+
+
+def _should_pin(block: dict) -> bool:
+    """Large, immutable tool results worth their own breakpoint."""
+    content = block.get("content")
+    return (
+        block.get("type") == "tool_result"
+        and isinstance(content, str)
+        and (len(content) >= CACHE_PIN_CHARS or content.startswith("<skill-loaded"))
+    )
+
+
+def mark_cache_breakpoints(messages: list):
+    """
+    Move cache_control markers to the current breakpoints, in place.
+
+    Only the markers move; message content is never changed, so the prefix
+    stays byte-identical from turn to turn.
+    """
+    blocks = []
+    for msg in messages:
+        if msg["role"] != "user":
+            continue
+        if isinstance(msg["content"], str):
+            msg["content"] = [{"type": "text", "text": msg["content"]}]
+        blocks.extend(msg["content"])
+
+    if not blocks:
+        return
+    for block in blocks:
+        block.pop("cache_control", None)
+
+    pinned = [b for b in blocks[:-1] if _should_pin(b)][-(MAX_MESSAGE_BREAKPOINTS - 1):]
+    for block in pinned + [blocks[-1]]:
+        block["cache_control"] = {"type": "ephemeral"}
+
+
 # =============================================================================
 # Main Agent Loop
 # =============================================================================
@@ -695,9 +757,10 @@ def agent_loop(messages: list) -> list:
     When model loads a skill, it receives domain knowledge.
     """
     while True:
+        mark_cache_breakpoints(messages)
         response = client.messages.create(
             model=MODEL,
-            system=SYSTEM,
+            system=SYSTEM_BLOCKS,
             messages=messages,
             tools=ALL_TOOLS,
             max_tokens=8000,
@@ -721,7 +784,7 @@ def agent_loop(messages: list) -> list:
                 print(f"\n> Task: {tc.input.get('description', 'subtask')}")
             elif tc.name == "Skill":
                 print(f"\n> Loading skill: {tc.input.get('skill', '?')}")
-            else:
+            elif VERBOSE:
                 print(f"\n> {tc.name}")
 
             output = execute_tool(tc.name, tc.input)
@@ -729,7 +792,7 @@ def agent_loop(messages: list) -> list:
             # Skill tool shows summary, not full content
             if tc.name == "Skill":
                 print(f"  Skill loaded ({len(output)} chars)")
-            elif tc.name != "Task":
+            elif tc.name != "Task" and VERBOSE:
                 preview = output[:200] + "..." if len(output) > 200 else output
                 print(f"  {preview}")
 
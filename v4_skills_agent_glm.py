@@ -83,22 +83,49 @@ SKILL.md 标准：
 import os
 import sys
 import json
+import hashlib
+import importlib.util
+import mmap
 import re
+import secrets
+import select
+import shlex
+import signal
 import subprocess
+import threading
 import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import lru_cache
+from itertools import islice
 from pathlib import Path
 
+# 环境初始化（locale 修正、读 .env）每个进程只做一次。标记放在模块全局里而不是
+# os.environ：importlib.reload 会复用同一个模块字典，所以重载时能看到它；
+# 而子进程（比如在别的项目里启动的代理）不会继承它，照常读取自己的 .env
+_FIRST_INIT = not globals().get("_INITIALIZED", False)
+
 # 修复 locale 编码问题（macOS/Linux）
-if sys.platform != "win32":
+if _FIRST_INIT and sys.platform != "win32":
     import locale
     if locale.getpreferredencoding().lower() != "utf-8":
         os.environ["LANG"] = "en_US.UTF-8"
         os.environ["LC_ALL"] = "en_US.UTF-8"
 
-from openai import OpenAI
-from dotenv import load_dotenv
+import httpx
+from openai import DefaultHttpxClient, OpenAI
+
+# 工具参数解析：装了 orjson 就用它（比标准库快数倍），否则退回 json
+try:
+    import orjson
+    _json_loads = orjson.loads
+except ImportError:
+    _json_loads = json.loads
 
-load_dotenv(override=True)
+if _FIRST_INIT:
+    from dotenv import load_dotenv
+    load_dotenv(override=True)
+    _INITIALIZED = True
 
 
 # =============================================================================
@@ -108,17 +135,38 @@ load_dotenv(override=True)
 WORKDIR = Path.cwd()
 SKILLS_DIR = WORKDIR / "skills"
 
+# 复用连接池：主代理和并发的子代理共用 keep-alive 连接，装了 h2 时启用 HTTP/2 多路复用；
+# 建连失败时由 transport 重试两次（请求级别的重试仍由 SDK 负责）
 client = OpenAI(
     api_key=os.getenv("ZHIPU_API_KEY", "your_api_key_here"),
-    base_url=os.getenv("ZHIPU_BASE_URL", "https://open.bigmodel.cn/api/paas/v4")
+    base_url=os.getenv("ZHIPU_BASE_URL", "https://open.bigmodel.cn/api/paas/v4"),
+    http_client=DefaultHttpxClient(
+        transport=httpx.HTTPTransport(
+            http2=importlib.util.find_spec("h2") is not None,
+            limits=httpx.Limits(max_keepalive_connections=32, max_connections=64, keepalive_expiry=60.0),
+            retries=2,
+        ),
+        timeout=httpx.Timeout(120.0, connect=10.0),
+    ),
 )
 MODEL = os.getenv("MODEL_ID", "glm-4.7")
+# MCC_VERBOSE=0 时不打印每个工具的参数和输出预览（批量/CI 运行时省掉这部分终端开销）
+VERBOSE = os.getenv("MCC_VERBOSE", "1") != "0"
 
 
 # =============================================================================
 # SkillLoader - v4 的核心新增内容
 # =============================================================================
 
+def _user_cache_dir() -> Path:
+    """当前用户自己的缓存目录（Linux 上是 ~/.cache/mini-claude-code）。"""
+    if sys.platform == "win32":
+        base = os.getenv("LOCALAPPDATA") or Path.home() / "AppData" / "Local"
+    else:
+        base = os.getenv("XDG_CACHE_HOME") or Path.home() / ".cache"
+    return Path(base) / "mini-claude-code"
+
+
 class SkillLoader:
     """
     从 SKILL.md 文件加载和管理技能。
@@ -153,8 +201,66 @@ class SkillLoader:
     def __init__(self, skills_dir: Path):
         self.skills_dir = skills_dir
         self.skills = {}
+        self._content_cache = {}  # 技能名 -> (SKILL.md 的 stat 键, get_skill_content 的结果)
+        # 子代理在多个线程里并发调用 Skill：写入时加锁，并且总是整体替换字典，
+        # 读取方拿到的引用不会被原地修改，因此读取不加锁
+        self._lock = threading.Lock()
         self.load_skills()
 
+    def _cache_path(self) -> Path:
+        """
+        解析缓存文件：路径 -> (mtime_ns, size, 解析结果)，未改动的 SKILL.md 启动时不再读取和解析。
+
+        放在用户缓存目录而不是工作区里，按技能目录的绝对路径区分；格式是 JSON，
+        就算文件被人动过，读出来的也只是数据。
+        """
+        digest = hashlib.sha256(str(self.skills_dir.resolve()).encode()).hexdigest()[:16]
+        return _user_cache_dir() / f"skills-{digest}.json"
+
+    def _load_cache(self) -> dict:
+        """读取解析缓存；文件不存在或损坏时返回空字典，格式不对的条目跳过。"""
+        try:
+            with open(self._cache_path(), encoding="utf-8") as f:
+                raw = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        if not isinstance(raw, dict):
+            return {}
+        cache = {}
+        for key, entry in raw.items():
+            try:
+                mtime_ns, size, meta = entry
+                skill = None
+                if meta is not None:
+                    path = Path(key)
+                    skill = {
+                        "name": str(meta["name"]),
+                        "description": str(meta["description"]),
+                        "body": str(meta["body"]),
+                        "path": path,
+                        "dir": path.parent,
+                    }
+            except (TypeError, ValueError, KeyError):
+                continue
+            cache[key] = (mtime_ns, size, skill)
+        return cache
+
+    def _save_cache(self, cache: dict):
+        """先写临时文件再替换，中途失败不会留下半个缓存；目录不可写时忽略。"""
+        path = self._cache_path()
+        raw = {
+            key: [mtime_ns, size, skill and {k: skill[k] for k in ("name", "description", "body")}]
+            for key, (mtime_ns, size, skill) in cache.items()
+        }
+        tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(raw, f, ensure_ascii=False)
+            os.replace(tmp, path)
+        except OSError:
+            pass
+
     def parse_skill_md(self, path: Path) -> dict:
         """
         将 SKILL.md 文件解析为元数据和主体。
@@ -164,18 +270,29 @@ class SkillLoader:
         """
         content = path.read_text()
 
-        # 在 --- 标记之间匹配 YAML frontmatter
-        match = re.match(r"^---\s*\n(.*?)\n---\s*\n(.*)$", content, re.DOTALL)
-        if not match:
+        # YAML frontmatter 在两行 --- 之间：分隔符是固定的整行，用字符串查找即可，
+        # 不必对整个文件跑 DOTALL 正则
+        first, _, rest = content.partition("\n")
+        if first.rstrip() != "---":
+            return None
+        idx = rest.find("\n---")
+        while idx >= 0:
+            line_end = rest.find("\n", idx + 4)
+            if line_end < 0:
+                return None
+            if not rest[idx + 4:line_end].strip():  # 结束行只能是 --- 加空白
+                break
+            idx = rest.find("\n---", idx + 1)
+        else:
             return None
 
-        frontmatter, body = match.groups()
+        frontmatter, body = rest[:idx], rest[line_end + 1:]
 
         # 解析类 YAML frontmatter（简单的 key: value）
         metadata = {}
         for line in frontmatter.strip().split("\n"):
-            if ":" in line:
-                key, value = line.split(":", 1)
+            key, sep, value = line.partition(":")
+            if sep:
                 metadata[key.strip()] = value.strip().strip("\"'")
 
         # 需要 name 和 description
@@ -200,17 +317,53 @@ class SkillLoader:
         if not self.skills_dir.exists():
             return
 
+        old_cache = self._load_cache()
+        new_cache = {}
+
+        # 先收集所有 SKILL.md 并对照缓存，需要重新解析的放进 stale
+        entries = []  # (路径, stat 键)
+        stale = []
         for skill_dir in self.skills_dir.iterdir():
             if not skill_dir.is_dir():
                 continue
 
             skill_md = skill_dir / "SKILL.md"
-            if not skill_md.exists():
+            try:
+                st = skill_md.stat()
+            except OSError:
                 continue
 
-            skill = self.parse_skill_md(skill_md)
+            stat_key = (st.st_mtime_ns, st.st_size)
+            entries.append((skill_md, stat_key))
+            # mtime 和大小都没变就直接用上次的解析结果
+            cached = old_cache.get(str(skill_md))
+            if cached and cached[:2] == stat_key:
+                new_cache[str(skill_md)] = cached
+            else:
+                stale.append(skill_md)
+
+        # 读文件是 I/O 密集型：未命中缓存的 SKILL.md 用线程池并行解析
+        if len(stale) > 1:
+            with ThreadPoolExecutor(max_workers=min(32, len(stale))) as pool:
+                parsed = list(pool.map(self.parse_skill_md, stale))
+        else:
+            parsed = [self.parse_skill_md(path) for path in stale]
+        parsed = dict(zip(stale, parsed))
+
+        # 按目录顺序在主线程里汇总
+        skills = {}
+        for skill_md, stat_key in entries:
+            if skill_md in parsed:
+                new_cache[str(skill_md)] = (*stat_key, parsed[skill_md])
+            skill = new_cache[str(skill_md)][2]
             if skill:
-                self.skills[skill["name"]] = skill
+                skills[skill["name"]] = {**skill, "stat": stat_key}
+        with self._lock:
+            self.skills = skills
+            self._content_cache = {}
+
+        if new_cache != old_cache:
+            self._save_cache(new_cache)
 
     def get_descriptions(self) -> str:
         """
@@ -235,11 +388,28 @@ class SkillLoader:
         资源（第 3 层提示）。
 
         如果技能未找到则返回 None。
+        结果按名称缓存，并带上 SKILL.md 的 (mtime_ns, size)：会话中改过的技能
+        下次调用时重新解析。系统提示词里的描述仍以启动时为准，保持请求前缀不变。
         """
-        if name not in self.skills:
+        skill = self.skills.get(name)
+        if skill is None:
             return None
+        try:
+            st = skill["path"].stat()
+            stat_key = (st.st_mtime_ns, st.st_size)
+        except OSError:
+            stat_key = skill["stat"]  # 文件被删掉了，继续用已加载的内容
+        cached = self._content_cache.get(name)
+        if cached is not None and cached[0] == stat_key:
+            return cached[1]
+
+        if stat_key != skill["stat"]:
+            fresh = self.parse_skill_md(skill["path"])
+            if fresh and fresh["name"] == name:
+                skill = {**fresh, "stat": stat_key}
+                with self._lock:
+                    self.skills = {**self.skills, name: skill}
 
-        skill = self.skills[name]
         content = f"# Skill: {skill['name']}\n\n{skill['body']}"
 
         # 列出可用资源（第 3 层提示）
@@ -259,6 +429,15 @@ class SkillLoader:
             content += f"\n\n**{skill['dir']} 中的可用资源：**\n"
             content += "\n".join(f"- {r}" for r in resources)
 
+        with self._lock:
+            # 另一个线程可能刚算好同一版本的技能，以先写入的为准
+            cache = {**self._content_cache}
+            cached = cache.get(name)
+            if cached is not None and cached[0] == stat_key:
+                content = cached[1]
+            else:
+                cache[name] = (stat_key, content)
+            self._content_cache = cache
         return content
 
     def list_skills(self) -> list:
@@ -305,50 +484,51 @@ def get_agent_descriptions() -> str:
 # TodoManager（来自 v2）
 # =============================================================================
 
+_VALID_STATUS = frozenset(("pending", "in_progress", "completed"))
+_MARKS = {"completed": "[x]", "in_progress": "[>]", "pending": "[ ]"}
+
+
 class TodoManager:
     """任务列表管理器，带约束。详见 v2。"""
 
     def __init__(self):
-        self.items = []
+        # 子代理可能在别的线程里同时调用 TodoWrite：写入加锁且整体替换为新的元组，
+        # 读取只取一次引用，不会看到写了一半的列表
+        self.items = ()
+        self._lock = threading.Lock()
 
     def update(self, items: list) -> str:
-        validated = []
-        in_progress = 0
-
-        for i, item in enumerate(items):
-            content = str(item.get("content", "")).strip()
-            status = str(item.get("status", "pending")).lower()
-            active = str(item.get("activeForm", "")).strip()
-
-            if not content or not active:
+        # 先用一个推导式规范化所有字段，再一遍检查约束
+        validated = [
+            {
+                "content": str(item.get("content", "")).strip(),
+                "status": str(item.get("status", "pending")).lower(),
+                "activeForm": str(item.get("activeForm", "")).strip(),
+            }
+            for item in items
+        ]
+
+        for i, t in enumerate(validated):
+            if not t["content"] or not t["activeForm"]:
                 raise ValueError(f"第 {i} 项: content 和 activeForm 是必需的")
-            if status not in ("pending", "in_progress", "completed"):
+            if t["status"] not in _VALID_STATUS:
                 raise ValueError(f"第 {i} 项: 无效的 status")
-            if status == "in_progress":
-                in_progress += 1
 
-            validated.append({
-                "content": content,
-                "status": status,
-                "activeForm": active
-            })
-
-        if in_progress > 1:
+        if sum(t["status"] == "in_progress" for t in validated) > 1:
             raise ValueError("一次只能有一个任务处于 in_progress 状态")
 
-        self.items = validated[:20]
-        return self.render()
+        snapshot = tuple(validated[:20])
+        with self._lock:
+            self.items = snapshot
+        return self.render(snapshot)  # 格式化在锁外进行
 
-    def render(self) -> str:
-        if not self.items:
+    def render(self, items: tuple = None) -> str:
+        items = self.items if items is None else items
+        if not items:
             return "没有任务。"
-        lines = []
-        for t in self.items:
-            mark = "[x]" if t["status"] == "completed" else \
-                   "[>]" if t["status"] == "in_progress" else "[ ]"
-            lines.append(f"{mark} {t['content']}")
-        done = sum(1 for t in self.items if t["status"] == "completed")
-        return "\n".join(lines) + f"\n({done}/{len(self.items)} 已完成)"
+        lines = [f"{_MARKS[t['status']]} {t['content']}" for t in items]
+        done = sum(t["status"] == "completed" for t in items)
+        return "\n".join(lines) + f"\n({done}/{len(items)} 已完成)"
 
 
 TODO = TodoManager()
@@ -358,7 +538,8 @@ TODO = TodoManager()
 # 系统提示词 - v4 更新版
 # =============================================================================
 
-SYSTEM = f"""你是位于 {WORKDIR} 的编码代理。
+# 随环境变化的内容（工作目录）放在最后，前面的部分在不同会话间也逐字节相同
+SYSTEM = f"""你是一个编码代理。
 
 循环：规划 -> 使用工具行动 -> 报告。
 
@@ -373,7 +554,28 @@ SYSTEM = f"""你是位于 {WORKDIR} 的编码代理。
 - 对需要专注探索或实现的子任务使用 Task 工具
 - 使用 TodoWrite 跟踪多步工作
 - 优先使用工具而非文字。行动，而不只是解释。
-- 完成后，总结更改内容。"""
+- 完成后，总结更改内容。
+
+工作目录: {WORKDIR}"""
+
+# system 消息在启动时构建一次，之后永不修改：技能内容只作为 tool 结果追加到末尾，
+# 请求前缀（system + 工具定义 + 早期历史）逐字节不变，服务端的前缀缓存才能命中。
+# 服务端支持显式缓存标记时，可设 PROMPT_CACHE_MARKER=1 在 system 消息上加 cache_control
+_SYSTEM_MSG = {"role": "system", "content": SYSTEM}
+if os.getenv("PROMPT_CACHE_MARKER") == "1":
+    _SYSTEM_MSG["cache_control"] = {"type": "ephemeral"}
+
+# 每种子代理的 system 消息同样只构建一次，run_task 每次都传同一个对象
+_SUB_SYSTEM_MSGS = {
+    name: {"role": "system", "content": f"""你是 {name} 子代理。
+
+{config["prompt"]}
+
+完成任务并返回清晰、简洁的摘要。
+
+工作目录: {WORKDIR}"""}
+    for name, config in AGENT_TYPES.items()
+}
 
 
 # =============================================================================
@@ -527,63 +729,195 @@ SKILL_TOOL = {
 ALL_TOOLS = BASE_TOOLS + [TASK_TOOL, SKILL_TOOL]
 
 
+# AGENT_TYPES 是静态的，每种代理的工具列表在导入时算好，创建子代理时直接查表。
+# '*' 表示所有基础工具（但不包括 Task，防止无限递归）
+_TOOLS_BY_AGENT = {
+    name: BASE_TOOLS if cfg["tools"] == "*"
+    else [t for t in BASE_TOOLS if t["function"]["name"] in cfg["tools"]]
+    for name, cfg in AGENT_TYPES.items()
+}
+
+
 def get_tools_for_agent(agent_type: str) -> list:
     """根据代理类型过滤工具。"""
-    allowed = AGENT_TYPES.get(agent_type, {}).get("tools", "*")
-    if allowed == "*":
-        return BASE_TOOLS
-    return [t for t in BASE_TOOLS if t["name"] in allowed]
+    return _TOOLS_BY_AGENT.get(agent_type, BASE_TOOLS)
 
 
 # =============================================================================
 # 工具实现
 # =============================================================================
 
-def safe_path(p: str) -> Path:
+# 工作区根目录只解析一次；结尾带分隔符，前缀比较时 /work 不会误匹配 /work2
+_WORKDIR_RESOLVED = str(WORKDIR.resolve())
+_WORKDIR_PREFIX = os.path.join(_WORKDIR_RESOLVED, "")
+
+
+def _check_path(p: str) -> Path:
     """确保路径保持在工作区内（安全措施）。"""
     path = (WORKDIR / p).resolve()
-    if not path.is_relative_to(WORKDIR):
+    resolved = str(path)
+    if resolved != _WORKDIR_RESOLVED and not resolved.startswith(_WORKDIR_PREFIX):
         raise ValueError(f"路径逃逸工作区: {p}")
     return path
 
 
-def run_bash(cmd: str) -> str:
-    """执行 shell 命令。"""
-    # Windows 命令转换
-    if sys.platform == "win32":
-        cmd_map = {
-            "ls": "dir",
-            "cat": "type",
-            "grep": "findstr",
-            "rm": "del",
-            "mv": "move",
-            "cp": "copy",
-            "pwd": "cd",
-        }
-        for unix_cmd, win_cmd in cmd_map.items():
-            if cmd.strip().startswith(unix_cmd + " ") or cmd.strip() == unix_cmd:
-                cmd = cmd.replace(unix_cmd, win_cmd, 1)
-                break
+@lru_cache(maxsize=4096)
+def safe_path(p: str) -> Path:
+    """
+    带缓存的 _check_path，供读文件使用。
 
-    if any(d in cmd for d in ["rm -rf /", "sudo", "shutdown", "reboot"]):
-        return "错误: 危险命令被阻止"
+    resolve() 要逐级 stat/readlink，模型又会反复读同一批文件，所以按原始字符串缓存
+    （越界的路径抛异常，不会被缓存）。写文件仍走 _check_path 现场解析，
+    这样之后才出现的符号链接也会被检查到。
+    """
+    return _check_path(p)
+
+
+# Windows 命令转换（模型习惯用 Unix 命令）：一个正则匹配命令开头，再查表替换
+_WIN_CMD_MAP = {
+    "ls": "dir",
+    "cat": "type",
+    "grep": "findstr",
+    "rm": "del",
+    "mv": "move",
+    "cp": "copy",
+    "pwd": "cd",
+}
+_WIN_CMD_RE = re.compile(r"^\s*(ls|cat|grep|rm|mv|cp|pwd)(?=\s|$)")
+
+# 危险命令黑名单编译成一个正则：每次调用只扫描一遍命令
+DANGEROUS = ["rm -rf /", "sudo", "shutdown", "reboot"]
+_DANGEROUS_RE = re.compile("|".join(map(re.escape, DANGEROUS)))
+
+
+# 持久 shell：bash 调用复用同一个进程（首次调用时惰性启动），
+# 省掉每条命令 fork+exec 一个新 shell 的开销，同时保留 cd、export 等状态
+_SHELL = None
+_SHELL_LOCK = threading.Lock()  # 同一时刻只能有一条命令写入 shell
+# 结束标记是 __END_<随机数>_<退出码>__，随机数每条命令重新生成：
+# 命令自己的输出里即使出现 __END__ 之类的字样，也不会被误认为结束
+_EXIT_RE = re.compile(rb"\d+__\n")
+_OUTPUT_LIMIT = 50000  # 工具输出上限（字节），超出部分不进入上下文
+
+
+def _find_end(buf: bytes, tag: bytes) -> int:
+    """返回结束标记在 buf 中的位置，没有完整的标记时返回 -1。"""
+    idx = buf.find(tag)
+    if idx >= 0 and _EXIT_RE.match(buf, idx + len(tag)):
+        return idx
+    return -1
+
+
+def _get_shell() -> subprocess.Popen:
+    """返回持久 bash 进程，不存在或已退出时重新启动。"""
+    global _SHELL
+    if _SHELL is None or _SHELL.poll() is not None:
+        _SHELL = subprocess.Popen(
+            ["bash", "--noprofile", "--norc"],
+            cwd=WORKDIR,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            start_new_session=True,  # 独立进程组，超时时可以整组终止
+        )
+    return _SHELL
+
+
+def _kill_shell():
+    """终止持久 shell 及其子进程，下次调用时会重新启动。"""
+    global _SHELL
+    if _SHELL is not None:
+        try:
+            os.killpg(_SHELL.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+        _SHELL.wait()
+        _SHELL = None
+
+
+def _read_until_marker(shell: subprocess.Popen, tag: bytes, timeout: float):
+    """
+    读取命令输出直到结束标记，最多保留 _OUTPUT_LIMIT 字节，超出部分边读边丢弃。
+
+    超时返回 None。
+    """
+    fd = shell.stdout.fileno()
+    out = bytearray()
+    tail = b""  # 可能包含半个结束标记的尾部，暂不写入 out
+    deadline = time.monotonic() + timeout
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0 or not select.select([fd], [], [], remaining)[0]:
+            return None
+        chunk = os.read(fd, 65536)
+        if not chunk:
+            # shell 已退出（例如命令中有 exit），下次调用时重启
+            _kill_shell()
+            return bytes(out + tail[:max(_OUTPUT_LIMIT - len(out), 0)])
+        tail += chunk
+        end = _find_end(tail, tag)
+        if end >= 0:
+            out += tail[:end][:max(_OUTPUT_LIMIT - len(out), 0)]
+            return bytes(out)
+        out += tail[:-64][:max(_OUTPUT_LIMIT - len(out), 0)]
+        tail = tail[-64:]
+
+
+def _run_oneshot(cmd: str) -> str:
+    """在新的 shell 进程中执行命令（Windows 没有 bash）。"""
     try:
         r = subprocess.run(
             cmd, shell=True, cwd=WORKDIR,
             capture_output=True, text=True, timeout=60
         )
         return ((r.stdout + r.stderr).strip() or "(无输出)")[:50000]
+    except subprocess.TimeoutExpired:
+        return "错误: 超时"
     except Exception as e:
         return f"错误: {e}"
 
 
+def run_bash(cmd: str) -> str:
+    """执行 shell 命令。"""
+    if sys.platform == "win32":
+        # 只替换命令开头的 Unix 命令
+        cmd = _WIN_CMD_RE.sub(lambda m: _WIN_CMD_MAP[m.group(1)], cmd, count=1)
+
+    if _DANGEROUS_RE.search(cmd):
+        return "错误: 危险命令被阻止"
+
+    if sys.platform == "win32":
+        return _run_oneshot(cmd)
+    # 持久 shell 被占用时排队等待：每条命令都在同一个 shell 里运行，cd、export 才总是生效
+    with _SHELL_LOCK:
+        try:
+            shell = _get_shell()
+            tag = f"__END_{secrets.token_hex(8)}_"
+            # eval 让语法错误立即报告，而不是吞掉结束标记；
+            # stdin 重定向到 /dev/null，防止命令读走后面的输入
+            shell.stdin.write(f"eval {shlex.quote(cmd)} < /dev/null\necho {tag}$?__\n".encode())
+            shell.stdin.flush()
+
+            out = _read_until_marker(shell, tag.encode(), 60)
+            if out is None:
+                _kill_shell()
+                return "错误: 超时"
+            return out.decode(errors="replace").strip() or "(无输出)"
+        except Exception as e:
+            _kill_shell()
+            return f"错误: {e}"
+
+
 def run_read(path: str, limit: int = None) -> str:
     """读取文件内容。"""
     try:
-        lines = safe_path(path).read_text().splitlines()
-        if limit:
-            lines = lines[:limit]
-        return "\n".join(lines)[:50000]
+        with safe_path(path).open() as f:
+            if limit:
+                # 只读前 limit 行，不把整个文件读进内存
+                return "\n".join(line.rstrip("\r\n") for line in islice(f, limit))[:50000]
+            # 反正要截断到 50000 字符，多读一个字符就够判断是否超长
+            text = f.read(50001)
+        return text[:50000] if len(text) > 50000 else text.removesuffix("\n")
     except Exception as e:
         return f"错误: {e}"
 
@@ -591,9 +925,16 @@ def run_read(path: str, limit: int = None) -> str:
 def run_write(path: str, content: str) -> str:
     """将内容写入文件。"""
     try:
-        fp = safe_path(path)
+        fp = _check_path(path)
         fp.parent.mkdir(parents=True, exist_ok=True)
-        fp.write_text(content)
+        # 一次编码成 bytes 直接交给 write(2)，不经过文本层的缓冲和分块编码
+        data = memoryview(content.encode())
+        fd = os.open(fp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, "O_BINARY", 0), 0o644)
+        try:
+            while data:
+                data = data[os.write(fd, data):]
+        finally:
+            os.close(fd)
         return f"写入 {len(content)} 字节到 {path}"
     except Exception as e:
         return f"错误: {e}"
@@ -602,12 +943,32 @@ def run_write(path: str, content: str) -> str:
 def run_edit(path: str, old_text: str, new_text: str) -> str:
     """替换文件中的精确文本。"""
     try:
-        fp = safe_path(path)
-        text = fp.read_text()
-        if old_text not in text:
-            return f"错误: 在 {path} 中未找到文本"
-        fp.write_text(text.replace(old_text, new_text, 1))
-        return f"已编辑 {path}"
+        fp = _check_path(path)
+        old = old_text.encode()
+        with open(fp, "r+b") as f:
+            # 用 mmap 在字节上查找，不把整个文件解码成 str 再复制一份
+            if os.fstat(f.fileno()).st_size:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    idx = mm.find(old)
+                    tail = mm[idx + len(old):] if idx >= 0 else None
+                    has_cr = idx < 0 and mm.find(b"\r") >= 0
+            else:
+                idx, tail, has_cr = (-1 if old else 0), b"", False
+            if idx >= 0:
+                # 匹配位置之前的内容不动，只从匹配处重写到文件末尾
+                f.seek(idx)
+                f.write(new_text.encode() + tail)
+                f.truncate()
+                return f"已编辑 {path}"
+
+        # CRLF 文件：按文本模式读取时换行已统一为 \n，退回原来的做法
+        if has_cr:
+            text = fp.read_text()
+            idx = text.find(old_text)
+            if idx >= 0:
+                fp.write_text(text[:idx] + new_text + text[idx + len(old_text):])
+                return f"已编辑 {path}"
+        return f"错误: 在 {path} 中未找到文本"
     except Exception as e:
         return f"错误: {e}"
 
@@ -650,186 +1011,437 @@ def run_skill(skill_name: str) -> str:
 按照上述技能中的说明完成用户的任务。"""
 
 
+# 只读子代理（不能写文件）的结果缓存：父代理重试或用同样的问题再问一次时直接返回。
+# 键为 (代理类型, 提示词) 的哈希，值为 (时间, 结果)。
+# 和 _TOOL_CACHE 一起失效：execute_tool 里任何可能改动工作区的调用（写文件、编辑、
+# 非只读的 bash）都会清空它，每轮用户输入开始时也清空
+TASK_CACHE_TTL = float(os.getenv("TASK_CACHE_TTL", "300"))  # 秒，0 表示关闭
+_TASK_CACHE: dict[str, tuple[float, str]] = {}
+
+
+def _task_cache_key(agent_type: str, prompt: str):
+    """只读代理类型返回缓存键，可写的代理类型返回 None（不缓存）。"""
+    tools = AGENT_TYPES[agent_type]["tools"]
+    if not TASK_CACHE_TTL or tools == "*" or {"write_file", "edit_file"} & set(tools):
+        return None
+    return hashlib.blake2b(f"{agent_type}\0{prompt}".encode()).hexdigest()
+
+
+_PROGRESS_INTERVAL = 0.033  # 进度行最多每秒刷新约 30 次，避免频繁 flush 拖慢终端（尤其是 SSH）
+_CLEAR_LINE = "\x1b[2K\r"  # 先清掉整行再回到行首，不会残留上一次更长的进度文字
+
+
 def run_task(description: str, prompt: str, agent_type: str) -> str:
     """执行子代理任务（来自 v3）。详见 v3。"""
     if agent_type not in AGENT_TYPES:
         return f"错误: 未知的代理类型 '{agent_type}'"
 
-    config = AGENT_TYPES[agent_type]
-    sub_system = f"""你是位于 {WORKDIR} 的 {agent_type} 子代理。
-
-{config["prompt"]}
-
-完成任务并返回清晰、简洁的摘要。"""
+    cache_key = _task_cache_key(agent_type, prompt)
+    if cache_key:
+        cached = _TASK_CACHE.get(cache_key)
+        if cached and time.time() - cached[0] < TASK_CACHE_TTL:
+            print(f"  [{agent_type}] {description} ... (缓存)")
+            return cached[1]
+    else:
+        _TASK_CACHE.clear()  # 可写的子代理会改动工作区，之前的只读结果可能过期
 
     sub_tools = get_tools_for_agent(agent_type)
-    sub_messages = [{"role": "user", "content": prompt}]
+    sub_messages = [_SUB_SYSTEM_MSGS[agent_type], {"role": "user", "content": prompt}]
 
     print(f"  [{agent_type}] {description}")
-    start = time.time()
+    start = time.monotonic()
     tool_count = 0
+    last_progress = 0.0
 
     while True:
-        response = client.chat.completions.create(
-            model=MODEL,
-            messages=[{"role": "system", "content": sub_system}] + sub_messages,
-            tools=sub_tools,
-            temperature=0.7
-        )
-
-        msg = response.choices[0].message
+        # 子代理静默运行：不回显文本，只更新进度行
+        assistant_msg, calls = stream_turn(sub_messages, sub_tools, echo=False)
+        sub_messages.append(assistant_msg)
 
-        if not msg.tool_calls:
+        if not calls:
             break
 
-        # 保存助手消息
-        sub_messages.append({
-            "role": "assistant",
-            "content": msg.content or "",
-            "tool_calls": [
-                {
-                    "id": tc.id,
-                    "type": tc.type,
-                    "function": {
-                        "name": tc.function.name,
-                        "arguments": tc.function.arguments
-                    }
-                }
-                for tc in msg.tool_calls
-            ]
-        })
-
-        results = []
-
-        for tc in msg.tool_calls:
-            tool_count += 1
-            func_name = tc.function.name
-            func_args = json.loads(tc.function.arguments)
-            output = execute_tool(func_name, func_args)
-            results.append({
+        for call_id, _, _, future in calls:
+            sub_messages.append({
                 "role": "tool",
-                "tool_call_id": tc.id,
-                "content": output
+                "tool_call_id": call_id,
+                "content": _tool_output(future)
             })
 
-            # 更新进度行（就地）
-            elapsed = time.time() - start
+        # 更新进度行（就地，限频；完成行总会输出）
+        tool_count += len(calls)
+        elapsed = time.monotonic() - start
+        if elapsed - last_progress >= _PROGRESS_INTERVAL:
+            last_progress = elapsed
             sys.stdout.write(
-                f"\r  [{agent_type}] {description} ... {tool_count} 工具, {elapsed:.1f}秒"
+                f"{_CLEAR_LINE}  [{agent_type}] {description} ... {tool_count} 工具, {elapsed:.1f}秒"
             )
             sys.stdout.flush()
 
-        sub_messages.append({"role": "user", "content": results})
-
     # 最终进度更新
-    elapsed = time.time() - start
+    elapsed = time.monotonic() - start
     sys.stdout.write(
-        f"\r  [{agent_type}] {description} - 完成 ({tool_count} 工具, {elapsed:.1f}秒)\n"
+        f"{_CLEAR_LINE}  [{agent_type}] {description} - 完成 ({tool_count} 工具, {elapsed:.1f}秒)\n"
     )
 
-    if msg.content:
-        return msg.content
+    result = assistant_msg["content"] or "(子代理没有返回文本)"
+    if cache_key:
+        _TASK_CACHE[cache_key] = (time.time(), result)
+    return result
+
+
+# 工具名 -> 处理函数，分发时一次字典查找
+_DISPATCH = {
+    "bash": lambda args: run_bash(args["command"]),
+    "read_file": lambda args: run_read(args["path"], args.get("limit")),
+    "write_file": lambda args: run_write(args["path"], args["content"]),
+    "edit_file": lambda args: run_edit(args["path"], args["old_text"], args["new_text"]),
+    "TodoWrite": lambda args: run_todo(args["items"]),
+    "Task": lambda args: run_task(args["description"], args["prompt"], args["agent_type"]),
+    "Skill": lambda args: run_skill(args["skill"]),
+}
 
-    return "(子代理没有返回文本)"
+
+# 工具结果缓存：模型经常用相同参数重复读同一个文件、重复 ls / git status。
+# read_file 的键里带文件的 (mtime_ns, size)，文件一变就自然失效；只读 bash 命令没法这样判断，
+# 所以任何可能改动工作区的调用（写文件、编辑、其他 bash 命令）执行前后都会清空整个缓存，
+# 每轮用户输入开始时也清空一次（用户可能在两轮之间改过文件）。
+# 时间戳精度有限，同样大小的改写可能不改变 (mtime_ns, size)：和改动并发执行的读取
+# 可能读到旧内容，所以读取期间只要有改动完成（_TOOL_CACHE_GEN 变了），结果就不写入缓存。
+# Skill 不需要在这里缓存：SkillLoader 已经缓存了技能内容
+_TOOL_CACHE: OrderedDict = OrderedDict()
+_TOOL_CACHE_MAX = 512
+_TOOL_CACHE_LOCK = threading.Lock()  # 工具在多个线程里并发执行
+_TOOL_CACHE_GEN = 0  # 改动类调用完成的次数
+_MUTATING_TOOLS = ("bash", "write_file", "edit_file")
+_READONLY_BASH_RE = re.compile(r"^\s*(ls|pwd|cat|type|dir|git status|git log)(?=\s|$)")
+_SHELL_META_RE = re.compile(r"[;&|<>`$\n]")  # 带重定向、管道、命令替换的不算只读
+
+
+def _tool_cache_key(name: str, args: dict):
+    """可缓存的调用返回缓存键，否则返回 None。"""
+    if name == "read_file":
+        try:
+            st = safe_path(args["path"]).stat()
+        except Exception:
+            return None  # 交给 run_read 报告错误
+        return (name, args["path"], args.get("limit"), st.st_mtime_ns, st.st_size)
+    if name == "bash":
+        cmd = args["command"]
+        if _READONLY_BASH_RE.match(cmd) and not _SHELL_META_RE.search(cmd):
+            return (name, cmd)
+    return None
 
 
 def execute_tool(name: str, args: dict) -> str:
-    """将工具调用分发到实现。"""
-    if name == "bash":
-        return run_bash(args["command"])
-    if name == "read_file":
-        return run_read(args["path"], args.get("limit"))
-    if name == "write_file":
-        return run_write(args["path"], args["content"])
-    if name == "edit_file":
-        return run_edit(args["path"], args["old_text"], args["new_text"])
-    if name == "TodoWrite":
-        return run_todo(args["items"])
+    """将工具调用分发到实现，只读调用先查结果缓存。"""
+    global _TOOL_CACHE_GEN
+    handler = _DISPATCH.get(name)
+    if handler is None:
+        return f"未知工具: {name}"
+
+    key = _tool_cache_key(name, args)
+    mutating = key is None and name in _MUTATING_TOOLS
+    with _TOOL_CACHE_LOCK:
+        if mutating:
+            _TOOL_CACHE.clear()
+            _TASK_CACHE.clear()
+        elif key in _TOOL_CACHE:
+            _TOOL_CACHE.move_to_end(key)
+            return _TOOL_CACHE[key]
+        gen = _TOOL_CACHE_GEN
+
+    output = handler(args)
+    with _TOOL_CACHE_LOCK:
+        if mutating:
+            # 改动期间并发完成的读取可能已经写入了旧内容
+            _TOOL_CACHE_GEN += 1
+            _TOOL_CACHE.clear()
+            _TASK_CACHE.clear()
+        elif key is not None and gen == _TOOL_CACHE_GEN and not output.startswith("错误"):
+            _TOOL_CACHE[key] = output
+            while len(_TOOL_CACHE) > _TOOL_CACHE_MAX:
+                _TOOL_CACHE.popitem(last=False)
+    return output
+
+
+# =============================================================================
+# 流式调用 - 工具参数一完整就开始执行
+# =============================================================================
+
+# 同一条响应里的只读调用和子代理都是 I/O 密集型（文件、子代理的 LLM 调用），
+# 线程并发执行时耗时取最长的一个而不是总和
+TOOL_CONCURRENCY_LIMIT = int(os.getenv("TOOL_CONCURRENCY_LIMIT", "8"))
+_TOOL_POOL = ThreadPoolExecutor(max_workers=TOOL_CONCURRENCY_LIMIT, thread_name_prefix="agent-tool")
+# 子代理单独一个池：它们会等待自己的工具，和普通工具共用一个池可能互相占满而卡死。
+# 子代理的耗时几乎全在等模型响应，并发数主要受服务端限流约束，可按需调大
+TASK_CONCURRENCY_LIMIT = int(os.getenv("TASK_CONCURRENCY_LIMIT", "4"))
+_TASK_POOL = ThreadPoolExecutor(max_workers=TASK_CONCURRENCY_LIMIT, thread_name_prefix="subagent")
+
+
+# 只读工具可以并发，同一轮里参数相同的只读调用只执行一次（模型常在一批里重复读同一个文件）；
+# bash、write_file、edit_file、TodoWrite 会改动工作区或全局状态
+_READ_ONLY_TOOLS = frozenset(("read_file", "Skill"))
+# 每个代理内部按调用顺序执行改动类工具，但并行的子代理之间仍可能同时改同一个文件：
+# 这类工具在整个进程内一次只执行一个
+_MUTATION_LOCK = threading.Lock()
+
+
+def _run_call(name: str, args: dict) -> str:
+    """执行一个工具调用；改动类工具持有 _MUTATION_LOCK（Task 不持有，否则子代理会等死在父代理上）。"""
+    if name in _READ_ONLY_TOOLS or name == "Task":
+        return execute_tool(name, args)
+    with _MUTATION_LOCK:
+        return execute_tool(name, args)
+
+
+class _DeferredCall(Future):
+    """
+    推迟到取结果时才执行的工具调用。
+
+    改动类工具不能并发：同一文件的两次 edit 会互相覆盖，write 之后的 bash 也可能先于写入运行。
+    agent_loop 和 run_task 都按原始顺序取结果，在 result() 里执行，
+    就保证它们按调用顺序、在之前的调用都结束后逐个运行。
+    """
+
+    def __init__(self, name: str, args: dict):
+        super().__init__()
+        self._call = (name, args)
+
+    def result(self, timeout=None):
+        if not self.done():
+            try:
+                self.set_result(_run_call(*self._call))
+            except Exception as e:
+                self.set_exception(e)
+        return super().result(timeout)
+
+
+def _new_turn() -> dict:
+    """一轮响应内的调度状态：已提交的只读调用，以及是否已经出现改动类调用。"""
+    return {"reads": {}, "ordered": False}
+
+
+def _start_tool(name: str, arguments: str, echo: bool, turn: dict):
+    """
+    解析参数并开始执行工具，返回 (参数, future)。
+
+    只读工具提交到工具池（参数相同的调用复用已有的 future），Task 提交到子代理池，二者并发执行；
+    改动类工具以及排在它后面的所有调用都推迟，按调用顺序逐个执行。
+    参数不是合法 JSON 时直接给出错误结果。
+    """
+    try:
+        args = _json_loads(arguments or "{}")
+    except ValueError as e:
+        future = Future()
+        future.set_result(f"错误: 参数无效: {e}")
+        return arguments, future
+    if name == "Task" and echo:
+        # 子代理运行时会输出自己的进度行，标题要在它启动前打印
+        print(f"\n> Task: {args.get('description', '子任务')}")
+    if turn["ordered"] or (name not in _READ_ONLY_TOOLS and name != "Task"):
+        turn["ordered"] = True
+        return args, _DeferredCall(name, args)
     if name == "Task":
-        return run_task(args["description"], args["prompt"], args["agent_type"])
-    if name == "Skill":
-        return run_skill(args["skill"])
-    return f"未知工具: {name}"
+        return args, _TASK_POOL.submit(execute_tool, name, args)
+    key = (name, json.dumps(args, sort_keys=True))
+    reads = turn["reads"]
+    if key not in reads:
+        reads[key] = (args, _TOOL_POOL.submit(execute_tool, name, args))
+    return reads[key]
+
+
+def _tool_output(future: Future) -> str:
+    """取出工具结果；单个工具失败不影响同批其他工具。"""
+    try:
+        return future.result()
+    except Exception as e:
+        return f"错误: {e}"
+
+
+def stream_turn(messages: list, tools: list, echo: bool = True):
+    """
+    流式调用模型一次。
+
+    文本边生成边打印（echo=False 时不打印）；只读工具和 Task 的 arguments
+    一拼成完整 JSON 就立即开始执行，不必等整条响应生成完，工具执行和模型生成因此重叠。
+    前面的调用都已开始后才会提前开始下一个，调度顺序始终和调用顺序一致。
+
+    返回 (assistant_msg, calls)，calls 按原始顺序排列，元素为 (id, 名称, 参数, future)。
+    """
+    stream = client.chat.completions.create(
+        model=MODEL,
+        messages=messages,
+        tools=tools,
+        temperature=0.7,
+        stream=True,
+    )
+    text = []
+    slots = {}  # index -> {"id", "name", "arguments", "call"}
+    turn = _new_turn()
+    for chunk in stream:
+        if not chunk.choices:
+            continue
+        delta = chunk.choices[0].delta
+        if delta.content:
+            if echo:
+                print(delta.content, end="", flush=True)
+            text.append(delta.content)
+        for tc in delta.tool_calls or ():
+            slot = slots.setdefault(tc.index, {"id": "", "name": "", "arguments": "", "call": None})
+            if tc.id:
+                slot["id"] = tc.id
+            if tc.function:
+                slot["name"] += tc.function.name or ""
+                slot["arguments"] += tc.function.arguments or ""
+            # JSON 对象只有在结尾的 } 到达后才能解析成功，所以解析成功即参数完整
+            if slot["call"] is None and slot["name"] and slot["arguments"].rstrip().endswith("}"):
+                if any(s["call"] is None for i, s in slots.items() if i < tc.index):
+                    continue
+                try:
+                    _json_loads(slot["arguments"])
+                except ValueError:
+                    continue
+                slot["call"] = _start_tool(slot["name"], slot["arguments"], echo, turn)
+    if text and echo:
+        print()
+
+    calls = []
+    for index in sorted(slots):
+        slot = slots[index]
+        if slot["call"] is None:
+            slot["call"] = _start_tool(slot["name"], slot["arguments"], echo, turn)
+        calls.append((slot["id"], slot["name"], *slot["call"]))
+
+    assistant_msg = {"role": "assistant", "content": "".join(text)}
+    if calls:
+        assistant_msg["tool_calls"] = [
+            {
+                "id": slots[index]["id"],
+                "type": "function",
+                "function": {
+                    "name": slots[index]["name"],
+                    "arguments": slots[index]["arguments"]
+                }
+            }
+            for index in sorted(slots)
+        ]
+    return assistant_msg, calls
 
 
 # =============================================================================
 # 主代理循环
 # =============================================================================
 
+# =============================================================================
+# 历史压缩
+# =============================================================================
+
+# 消息只在末尾追加、从不重排（工具结果也按调用顺序追加），所以每轮请求的前缀都和上一轮
+# 逐字节相同，服务端的前缀缓存才能命中。历史太长时压缩成滑动窗口：
+#   [system + 最早 COMPACT_PIN_TURNS 轮] + [摘要] + [最近 COMPACT_KEEP_TURNS 轮]
+# 开头固定的部分永远逐字节不变；再次压缩时旧摘要和新淘汰的轮次合并成新摘要
+COMPACT_AFTER = int(os.getenv("COMPACT_AFTER", "80"))  # 消息数超过这个值时压缩
+COMPACT_TOKENS = int(os.getenv("COMPACT_TOKENS", "60000"))  # 估算 token 数超过这个值时也压缩
+COMPACT_PIN_TURNS = int(os.getenv("COMPACT_PIN_TURNS", "1"))  # 原样保留的最早用户轮数（通常是任务本身）
+COMPACT_KEEP_TURNS = int(os.getenv("COMPACT_KEEP_TURNS", "4"))  # 原样保留的最近用户轮数
+_SUMMARY_SYSTEM = "把下面的编码代理对话压缩成简洁的摘要：保留用户目标、已做的修改、关键发现和未完成的事项。"
+_SUMMARY_TAG = "<history-summary>"
+
+
+def _approx_tokens(msg: dict) -> int:
+    """粗略估算一条消息的 token 数（约 4 字符一个），只用来决定何时压缩，不必精确。"""
+    n = len(msg.get("content") or "")
+    for tc in msg.get("tool_calls") or ():
+        n += len(tc["function"]["arguments"])
+    return n // 4
+
+
+def _transcript_line(msg: dict) -> str:
+    """把一条消息压成一行文本，供摘要使用（每条最多 2000 字符，旧摘要保留全文）。"""
+    text = msg.get("content") or ""
+    if text.startswith(_SUMMARY_TAG):
+        return f"[之前的摘要] {text}"
+    for tc in msg.get("tool_calls") or ():
+        text += f" [调用 {tc['function']['name']} {tc['function']['arguments']}]"
+    return f"[{msg['role']}] {text}"[:2000]
+
+
+def compact_history(messages: list) -> bool:
+    """
+    把固定开头（最早 COMPACT_PIN_TURNS 轮）和最近 COMPACT_KEEP_TURNS 轮之间的消息
+    （包括上一次的摘要）替换成一条新摘要。
+
+    只在用户轮次的边界切分，不会把 tool_calls 和它的工具结果拆开。
+    摘要失败时保持历史不变。返回是否做了压缩。
+    """
+    if len(messages) <= COMPACT_AFTER and sum(map(_approx_tokens, messages)) <= COMPACT_TOKENS:
+        return False
+    turn_starts = [i for i, m in enumerate(messages) if m.get("role") == "user"]
+    if len(turn_starts) <= COMPACT_PIN_TURNS + COMPACT_KEEP_TURNS:
+        return False
+    start = turn_starts[COMPACT_PIN_TURNS]
+    cut = turn_starts[-COMPACT_KEEP_TURNS] if COMPACT_KEEP_TURNS else len(messages)
+    if cut - start < 2:
+        return False  # 中间只剩上一次的摘要，没有可以再压缩的
+    transcript = "\n".join(_transcript_line(m) for m in messages[start:cut])
+    try:
+        response = client.chat.completions.create(
+            model=MODEL,
+            messages=[
+                {"role": "system", "content": _SUMMARY_SYSTEM},
+                {"role": "user", "content": transcript},
+            ],
+        )
+        summary = response.choices[0].message.content
+    except Exception as e:
+        print(f"(压缩历史失败: {e})")
+        return False
+    if not summary:
+        return False
+    messages[start:cut] = [{"role": "user", "content": f"{_SUMMARY_TAG}\n{summary}\n</history-summary>"}]
+    return True
+
+
 def agent_loop(messages: list) -> list:
     """
     支持技能的主代理循环。
 
     与 v3 相同的模式，但现在带有 Skill 工具。
     当模型加载技能时，它接收领域知识。
+
+    messages 以 _SYSTEM_MSG 开头（main 里建好），之后只追加（见 compact_history 上方的说明）。
     """
-    while True:
-        response = client.chat.completions.create(
-            model=MODEL,
-            messages=[{"role": "system", "content": SYSTEM}] + messages,
-            tools=ALL_TOOLS,
-            temperature=0.7
-        )
 
-        msg = response.choices[0].message
-
-        # 保存助手消息
-        assistant_msg = {"role": "assistant", "content": msg.content or ""}
-        if msg.tool_calls:
-            assistant_msg["tool_calls"] = [
-                {
-                    "id": tc.id,
-                    "type": tc.type,
-                    "function": {
-                        "name": tc.function.name,
-                        "arguments": tc.function.arguments
-                    }
-                }
-                for tc in msg.tool_calls
-            ]
+    while True:
+        # 流式调用模型（工具在生成过程中就开始执行）
+        assistant_msg, calls = stream_turn(messages, ALL_TOOLS)
         messages.append(assistant_msg)
 
-        # 打印文本输出
-        if msg.content:
-            print(msg.content)
-
         # 如果没有工具调用，任务完成
-        if not msg.tool_calls:
+        if not calls:
             return messages
 
-        # 执行每个工具并收集结果
-        results = []
-        for tc in msg.tool_calls:
-            func_name = tc.function.name
-            func_args = json.loads(tc.function.arguments)
+        # 按原始顺序显示和收集结果
+        for call_id, func_name, func_args, future in calls:
+            output = _tool_output(future)
 
             # 不同工具类型的特殊显示
-            if func_name == "Task":
-                print(f"\n> Task: {func_args.get('description', '子任务')}")
-            elif func_name == "Skill":
+            if func_name == "Skill" and isinstance(func_args, dict):
                 print(f"\n> 正在加载技能: {func_args.get('skill', '?')}")
-            else:
-                print(f"\n> {func_name}: {func_args}")
-
-            output = execute_tool(func_name, func_args)
-
-            # Skill 工具显示摘要，不是完整内容
-            if func_name == "Skill":
+                # Skill 工具显示摘要，不是完整内容
                 print(f"  技能已加载 ({len(output)} 字符)")
-            elif func_name != "Task":
+            elif func_name != "Task" and VERBOSE:
+                print(f"\n> {func_name}: {func_args}")
                 preview = output[:200] + "..." if len(output) > 200 else output
                 print(f"  {preview}")
 
-            results.append({
+            messages.append({
                 "role": "tool",
-                "tool_call_id": tc.id,
+                "tool_call_id": call_id,
                 "content": output
             })
 
-        # 分别添加每个工具结果到消息历史
-        for result in results:
-            messages.append(result)
-
 
 # =============================================================================
 # 主 REPL
@@ -841,7 +1453,7 @@ def main():
     print(f"代理类型: {', '.join(AGENT_TYPES.keys())}")
     print("输入 'exit' 退出。\n")
 
-    history = []
+    history = [_SYSTEM_MSG]
 
     while True:
         try:
@@ -852,7 +1464,13 @@ def main():
         if not user_input or user_input.lower() in ("exit", "quit", "q"):
             break
 
+        # 在轮次之间压缩，不打断正在进行的工具调用
+        if compact_history(history):
+            print("(已将较早的对话压缩为摘要)")
         history.append({"role": "user", "content": user_input})
+        # 用户可能在两轮之间改过文件
+        _TOOL_CACHE.clear()
+        _TASK_CACHE.clear()
 
         try:
             agent_loop(history)